@@ -5,24 +5,34 @@ Demo deployment of apflow with rate limiting and pre-computed results.
 """
 
 import os
+from functools import cache
 from pathlib import Path
 
 __version__ = "0.3.0"
 
+# Set once the environment below has been prepared; child processes and
+# module reloads inherit it and skip the work
+_ENV_INITIALIZED_FLAG = "_APFLOW_DEMO_ENV_INITIALIZED"
+
+
+@cache
+def _find_project_root() -> Path:
+    """Find project root (where pyproject.toml or .env resides)"""
+    for parent in Path(__file__).resolve().parents:
+        if (parent / "pyproject.toml").exists() or (parent / ".env").exists():
+            return parent
+    return Path.cwd()
+
+
 # Set default DATABASE_URL if not provided
 def _initialize_database():
-    # Find project root (where pyproject.toml or .env resides)
-    current_path = Path(__file__).resolve()
-    project_root = None
-    for parent in current_path.parents:
-        if (parent / "pyproject.toml").exists() or (parent / ".env").exists():
-            project_root = parent
-            break
-    
-    if not project_root:
-        project_root = Path.cwd()
+    if os.getenv(_ENV_INITIALIZED_FLAG):
+        return
 
-    # Load .env from project root if it exists
+    project_root = _find_project_root()
+
+    # Load .env from project root if it exists (also carries non-database
+    # settings, so it is loaded even when DATABASE_URL is already set)
     env_path = project_root / ".env"
     if env_path.exists():
         from dotenv import load_dotenv
@@ -36,6 +46,8 @@ def _initialize_database():
         
         os.environ["DATABASE_URL"] = f"duckdb:///{db_path}"
 
+    os.environ[_ENV_INITIALIZED_FLAG] = "1"
+
 _initialize_database()
 
 # Import custom TaskModel extension to register it on package load
@@ -0,0 +1,27 @@
+"""
+Response compression middleware for the demo API routes
+"""
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Gzip responses of 1 KB or more from the demo /api/ routes
+    
+    Those routes return plain JSON (demo init status, task id lists, user
+    lists). apflow's JSON-RPC endpoint can stream server-sent events and is
+    passed through uncompressed.
+    """
+    
+    COMPRESS_PREFIXES = ("/api/",)
+    
+    def __init__(self, app: ASGIApp):
+        super().__init__(app, minimum_size=1000, compresslevel=5)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(self.COMPRESS_PREFIXES):
+            await super().__call__(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -10,6 +10,7 @@ For now, this middleware just tracks demo mode status.
 
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import Receive, Scope, Send
 from apflow_demo.config.settings import settings
 
 
@@ -21,6 +22,20 @@ class DemoModeMiddleware(BaseHTTPMiddleware):
     This middleware currently just adds demo mode header for downstream use.
     """
     
+    # Paths that never need demo mode state (static assets, health checks)
+    SKIP_PREFIXES = ("/health", "/static", "/assets", "/favicon")
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Nothing to mark: bypass BaseHTTPMiddleware's task and stream setup entirely
+        if (
+            scope["type"] != "http"
+            or not settings.demo_mode
+            or scope["path"].startswith(self.SKIP_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+    
     async def dispatch(self, request: Request, call_next):
         """Add demo mode information to request"""
         
@@ -10,14 +10,19 @@ Note: LLM API keys are handled by apflow's LLMAPIKeyMiddleware,
 which uses thread-local context instead of environment variables for security.
 """
 
-import json
-from typing import Any, Optional
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+import orjson
+from starlette.datastructures import MutableHeaders
 from starlette.requests import Request
-from starlette.responses import JSONResponse, StreamingResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from fastapi import status
 
 from apflow_demo.extensions.rate_limiter import RateLimiter
+from apflow_demo.storage.quota_repository import quota_reset_iso
+from apflow_demo.storage.session_scope import SessionScope, pooled_session
 from apflow_demo.utils.header_utils import (
     has_llm_key_in_header,
     extract_user_id_from_request,
@@ -28,55 +33,131 @@ from apflow.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Bytes read from the request body before deciding whether to buffer all of it
+_SNIFF_BYTES = 256
 
-class QuotaLimitMiddleware(BaseHTTPMiddleware):
-    """Middleware for checking task tree quotas before processing requests"""
+# A "method" member leading the JSON-RPC object (optionally after "jsonrpc"/"id").
+# Any other layout falls back to a full parse, so a nested "method" key inside
+# params is never mistaken for the RPC method.
+_LEADING_METHOD_RE = re.compile(
+    rb'\s*\{\s*(?:"(?:jsonrpc|id)"\s*:\s*(?:"[^"\\]*"|[-\w.]+)\s*,\s*)*"method"\s*:\s*"([^"\\]*)"'
+)
+
+# Pre-serialized JSON-RPC error framing for 429 rejections; only the request
+# id and the error data are serialized per rejected request.
+_QUOTA_EXCEEDED_ERROR = b'"error":{"code":-32001,"message":"Daily task tree quota exceeded","data":'
+_CONCURRENCY_LIMIT_ERROR = b'"error":{"code":-32002,"message":"Concurrency limit reached","data":'
+
+
+def _rejection_response(error: bytes, request_id: Any, data: Dict[str, Any]) -> Response:
+    """Build a 429 JSON-RPC error response from a pre-serialized error framing"""
+    content = b"".join((
+        b'{"jsonrpc":"2.0","id":', orjson.dumps(request_id), b",",
+        error, orjson.dumps(data), b"}}",
+    ))
+    return Response(
+        content=content,
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        media_type="application/json",
+    )
+
+
+# Task tree ids known to exist: task_id -> monotonic expiry. Only positive
+# results are kept, since a missing task can be created at any time.
+_existing_task_trees: Dict[str, float] = {}
+_EXISTING_TASK_TREE_TTL = 300
+_EXISTING_TASK_TREES_MAX = 10000
+
+
+class QuotaLimitMiddleware:
+    """
+    Middleware for checking task tree quotas before processing requests
+
+    Implemented as a plain ASGI middleware rather than BaseHTTPMiddleware:
+    the request body is buffered and replayed here, and only JSON responses
+    are buffered for quota info, so SSE streams pass through untouched.
+    """
+
+    # Skip quota checking for these path prefixes
+    SKIP_PREFIXES = ("/health", "/docs", "/openapi.json", "/redoc", "/auth", "/api/quota", "/api/demo", "/api/executors")
 
-    async def dispatch(self, request: Request, call_next):
+    # JSON-RPC methods that create task trees
+    TASK_METHODS = ("tasks.generate", "tasks.execute")
+    _TASK_METHODS_BYTES = tuple(method.encode() for method in TASK_METHODS)
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Check quota limits for task requests"""
-        
-        # Skip quota checking for certain paths
-        skip_paths = ["/health", "/docs", "/openapi.json", "/redoc", "/auth", "/api/quota", "/api/demo", "/api/executors"]
-        if any(request.url.path.startswith(path) for path in skip_paths):
-            return await call_next(request)
-        
+        if scope["type"] != "http" or scope["path"].startswith(self.SKIP_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
         if not settings.rate_limit_enabled:
-            return await call_next(request)
-        
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+
         # Only process JSON-RPC requests (A2A protocol)
         content_type = request.headers.get("content-type", "")
         if "application/json" not in content_type.lower():
-            return await call_next(request)
-        
-        # Read and parse request body
+            await self.app(scope, receive, send)
+            return
+
+        # Empty body: nothing to check
+        if request.headers.get("content-length") == "0":
+            await self.app(scope, receive, send)
+            return
+
+        # Read just enough of the body to sniff the JSON-RPC method
+        body_bytes, more_body = await self._read_body(receive, limit=_SNIFF_BYTES)
+        match = _LEADING_METHOD_RE.match(body_bytes)
+        if match and match.group(1) not in self._TASK_METHODS_BYTES:
+            # Not a task request: replay what was read, stream the rest untouched
+            await self.app(scope, self._replay_receive(body_bytes, receive, more_body), send)
+            return
+
+        # Read the rest of the request body; it is replayed to the route handler below
+        if more_body:
+            rest, _ = await self._read_body(receive)
+            body_bytes += rest
+        replay_receive = self._replay_receive(body_bytes, receive)
+        if not body_bytes:
+            await self.app(scope, replay_receive, send)
+            return
+
+        # Store body bytes in request.state so route handlers can access them
+        request.state.body_bytes = body_bytes
+
+        # Per-request memo of task tree existence checks (dispatch and response)
+        existing_task_trees: Dict[str, bool] = {}
+
+        # One pooled session shared by the checks below; it is released
+        # before the route handler runs so the connection is not held idle
+        db_scope = SessionScope()
+        db_scope.start()
+
         try:
-            body_bytes = await request.body()
-            if not body_bytes:
-                return await call_next(request)
-            
-            # Store body bytes in request.state so route handlers can access them
-            request.state.body_bytes = body_bytes
-            
-            body = json.loads(body_bytes.decode())
+            body = orjson.loads(body_bytes)
+            # Store parsed body in request.state for route handlers
+            request.state.parsed_body = body
             method = body.get("method")
-            
+
             # Only process tasks.generate and tasks.execute
-            if method not in ["tasks.generate", "tasks.execute"]:
-                # Store parsed body in request.state for route handlers
-                request.state.parsed_body = body
-                # Make body readable again for parent route handlers
-                async def receive():
-                    return {"type": "http.request", "body": body_bytes}
-                request._receive = receive
-                return await call_next(request)
-            
+            if method not in self.TASK_METHODS:
+                await db_scope.close()
+                await self.app(scope, replay_receive, send)
+                return
+
             params = body.get("params", {})
             request_id = body.get("id")
-            
+
             # Extract user info
             user_id = extract_user_id_from_request(request)
             is_premium = has_llm_key_in_header(request)
-            
+
             # Detect if LLM-consuming
             is_llm_consuming = False
             if method == "tasks.generate":
@@ -86,36 +167,31 @@ class QuotaLimitMiddleware(BaseHTTPMiddleware):
                 # Check from tasks array or task_id
                 tasks = params.get("tasks")
                 task_id = params.get("task_id") or params.get("id")
-                
+
                 # Skip quota check for re-execution of existing tasks
                 if task_id and not tasks:
                     # Check if task already exists (re-execution)
-                    is_existing = await self._is_existing_task_tree(task_id)
+                    is_existing = await self._is_existing_task_tree(task_id, existing_task_trees)
                     if is_existing:
                         # Re-execution - skip quota check, just pass through
-                        request.state.parsed_body = body
-                        async def receive():
-                            return {"type": "http.request", "body": body_bytes}
-                        request._receive = receive
-                        return await call_next(request)
-                
+                        await db_scope.close()
+                        await self.app(scope, replay_receive, send)
+                        return
+
                 if tasks and isinstance(tasks, list):
                     is_llm_consuming = detect_task_tree_from_tasks_array(tasks)
                 elif task_id:
                     # For execute with task_id, we'll check later in route
                     # Assume LLM-consuming for now, route will verify
                     is_llm_consuming = True
-            
-            # Check quota (only for new task trees)
-            allowed, quota_info = await RateLimiter.check_task_tree_quota(
+
+            # Check quota (only for new task trees) and concurrency limit in one pass
+            (allowed, quota_info), (concurrency_allowed, concurrency_info) = await RateLimiter.check_task_tree_limits(
                 user_id=user_id,
                 is_llm_consuming=is_llm_consuming,
                 has_llm_key=is_premium,
             )
-            
-            # Check concurrency limit
-            concurrency_allowed, concurrency_info = await RateLimiter.check_concurrency_limit(user_id)
-            
+
             # Store quota check results in request.state
             request.state.quota_check = {
                 "allowed": allowed and concurrency_allowed,
@@ -126,150 +202,185 @@ class QuotaLimitMiddleware(BaseHTTPMiddleware):
                 "is_premium": is_premium,
                 "use_demo": False,
             }
-            
+
+            rejection = None
+
             # Handle quota exceeded cases
             if not allowed:
                 if is_premium:
                     # Premium user exceeded quota - reject immediately
-                    return JSONResponse(
-                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                        content={
-                            "jsonrpc": "2.0",
-                            "id": request_id,
-                            "error": {
-                                "code": -32001,
-                                "message": "Daily task tree quota exceeded",
-                                "data": {
-                                    "reason": quota_info.get("reason"),
-                                    "total_used": quota_info.get("total_count"),
-                                    "total_limit": quota_info.get("total_limit"),
-                                    "reset_time": self._get_reset_time(),
-                                },
-                            },
-                        },
-                    )
+                    rejection = _rejection_response(_QUOTA_EXCEEDED_ERROR, request_id, {
+                        "reason": quota_info.get("reason"),
+                        "total_used": quota_info.get("total_count"),
+                        "total_limit": quota_info.get("total_limit"),
+                        "reset_time": quota_reset_iso(),
+                    })
                 else:
                     # Free user - set use_demo=True
                     if is_llm_consuming and quota_info.get("llm_quota_exceeded"):
                         logger.info(f"Free user {user_id} exceeded LLM quota, setting use_demo=True")
                         params["use_demo"] = True
                         request.state.quota_check["use_demo"] = True
-            
+
             # Handle concurrency limit exceeded
-            if not concurrency_allowed:
-                return JSONResponse(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    content={
-                        "jsonrpc": "2.0",
-                        "id": request_id,
-                        "error": {
-                            "code": -32002,
-                            "message": "Concurrency limit reached",
-                            "data": {
-                                "reason": concurrency_info.get("reason"),
-                                "current_concurrent": concurrency_info.get("user_current"),
-                                "max_concurrent": concurrency_info.get("user_limit"),
-                            },
-                        },
-                    },
-                )
-            
-            # Store parsed body and params (with potential use_demo modification) in request.state
+            if rejection is None and not concurrency_allowed:
+                rejection = _rejection_response(_CONCURRENCY_LIMIT_ERROR, request_id, {
+                    "reason": concurrency_info.get("reason"),
+                    "current_concurrent": concurrency_info.get("user_current"),
+                    "max_concurrent": concurrency_info.get("user_limit"),
+                })
+
+            if rejection is not None:
+                await db_scope.close()
+                await rejection(scope, receive, send)
+                return
+
+            # Keep params (with potential use_demo modification) on the parsed body in request.state
             body["params"] = params
-            request.state.parsed_body = body
-            
+
             # Set metadata for executor hooks
             if "metadata" not in params:
                 params["metadata"] = {}
             params["metadata"]["user_id"] = user_id
             params["metadata"]["has_llm_key"] = is_premium
-            
-            # Make body readable again for route handlers by replacing _receive
-            async def receive():
-                return {"type": "http.request", "body": body_bytes}
-            request._receive = receive
-            
-            # Continue to route handler
-            # Note: LLM API keys are handled by apflow's LLMAPIKeyMiddleware
-            # which uses thread-local context, not environment variables
-            response = await call_next(request)
-            
-            # Process response: track task trees and add quota info
-            response = await self._process_response(
-                response, method, params, request_id, user_id, is_llm_consuming, quota_info
-            )
-            
-            return response
-            
-        except json.JSONDecodeError:
+            await db_scope.close()
+
+        except orjson.JSONDecodeError:
             # Invalid JSON - let route handler deal with it
             logger.warning("Invalid JSON in request body, passing to route handler")
-            return await call_next(request)
+            await db_scope.close()
+            await self.app(scope, replay_receive, send)
+            return
         except Exception as e:
             # Error in quota checking - log but allow request to proceed
             logger.error(f"Error in quota limit middleware: {str(e)}", exc_info=True)
-            return await call_next(request)
-    
+            await db_scope.close()
+            await self.app(scope, replay_receive, send)
+            return
+
+        # Continue to route handler, intercepting JSON responses to
+        # track task trees and add quota info.
+        # Note: LLM API keys are handled by apflow's LLMAPIKeyMiddleware
+        # which uses thread-local context, not environment variables
+        response_start: Optional[Message] = None
+        response_chunks: list = []
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_start
+
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if "application/json" in headers.get("content-type", "").lower():
+                    # Hold the start message until the body has been processed
+                    response_start = message
+                    return
+            elif message["type"] == "http.response.body" and response_start is not None:
+                response_chunks.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+
+                body = b"".join(response_chunks)
+                try:
+                    body = await self._process_response(
+                        body, method, params, user_id, is_llm_consuming, quota_info, existing_task_trees
+                    )
+                except Exception as e:
+                    logger.error(f"Error processing quota response: {str(e)}", exc_info=True)
+
+                headers = MutableHeaders(scope=response_start)
+                headers["content-length"] = str(len(body))
+                await send(response_start)
+                await send({"type": "http.response.body", "body": body})
+                return
+
+            await send(message)
+
+        await self.app(scope, replay_receive, send_wrapper)
+
+    @staticmethod
+    async def _read_body(receive: Receive, limit: Optional[int] = None) -> Tuple[bytes, bool]:
+        """
+        Consume the request body from the ASGI receive channel
+
+        Args:
+            receive: ASGI receive callable
+            limit: Stop once at least this many bytes were read (None reads everything)
+
+        Returns:
+            Tuple of (bytes read, whether more body chunks remain)
+        """
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return bytes(body), False
+            body.extend(message.get("body", b""))
+            if not message.get("more_body", False):
+                return bytes(body), False
+            if limit is not None and len(body) >= limit:
+                return bytes(body), True
+
+    @staticmethod
+    def _replay_receive(body_bytes: bytes, receive: Receive, more_body: bool = False) -> Receive:
+        """Return a receive callable that yields the buffered body once"""
+        body_sent = False
+
+        async def replay() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body_bytes, "more_body": more_body}
+            # Body already delivered: remaining chunks, then the client disconnect
+            return await receive()
+
+        return replay
+
     async def _process_response(
         self,
-        response: Any,
+        body: bytes,
         method: str,
         params: dict,
-        request_id: Any,
         user_id: str,
         is_llm_consuming: bool,
         quota_info: dict,
-    ) -> Any:
-        """Process response: track task trees and add quota info"""
-        # Handle StreamingResponse (SSE mode) - return as-is
-        if isinstance(response, StreamingResponse):
-            return response
-        
-        # Extract result from JSONResponse
-        result_dict = None
-        if isinstance(response, JSONResponse):
-            result_content = response.body
-            if isinstance(result_content, bytes):
-                try:
-                    result_dict = json.loads(result_content.decode())
-                except json.JSONDecodeError:
-                    return response
-            else:
-                result_dict = result_content
-        elif isinstance(response, dict):
-            result_dict = response
-        else:
-            # Unknown response type, return as-is
-            return response
-        
+        existing_task_trees: Dict[str, bool],
+    ) -> bytes:
+        """Process a JSON response body: track task trees and add quota info"""
+        try:
+            result_dict = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return body
+
         # Get actual result data (handle both JSON-RPC format and direct dict)
-        actual_result = result_dict.get("result") if isinstance(result_dict, dict) and "result" in result_dict else result_dict
-        
+        actual_result = result_dict.get("result") if type(result_dict) is dict and "result" in result_dict else result_dict
+        # orjson only produces plain dicts, so one exact type check covers every branch below
+        result_is_dict = type(actual_result) is dict
+
         # Get root_task_id from result
         root_task_id = None
         if method == "tasks.generate":
-            if isinstance(actual_result, dict):
+            if result_is_dict:
                 root_task_id = actual_result.get("root_task_id")
                 # Detect actual LLM-consuming from generated tasks
                 generated_tasks = actual_result.get("tasks", [])
                 if generated_tasks:
                     is_llm_consuming = detect_task_tree_from_tasks_array(generated_tasks)
         elif method == "tasks.execute":
-            if isinstance(actual_result, dict):
+            if result_is_dict:
                 root_task_id = actual_result.get("root_task_id")
             task_id = params.get("task_id") or params.get("id")
             tasks = params.get("tasks")
             if not root_task_id:
                 root_task_id = task_id
-            
+
             # Only track if new task tree (not re-execution)
             # Re-execution: task_id exists and task already exists in DB, and no tasks array
             if root_task_id and not tasks:
-                is_existing = await self._is_existing_task_tree(root_task_id)
+                is_existing = await self._is_existing_task_tree(root_task_id, existing_task_trees)
                 if is_existing:
                     # Re-execution - don't track
                     root_task_id = None
-        
+
         # Start tracking for new task trees
         if root_task_id:
             await RateLimiter.start_task_tree(
@@ -277,47 +388,63 @@ class QuotaLimitMiddleware(BaseHTTPMiddleware):
                 task_tree_id=root_task_id,
                 is_llm_consuming=is_llm_consuming,
             )
-        
-        # Add quota info to response
-        quota_info_dict = {
+        elif "total_count" not in quota_info:
+            # Nothing tracked and no counts known (quota check unavailable)
+            return body
+
+        # Nothing to add: keep the original bytes instead of re-serializing
+        if not result_is_dict:
+            return body
+
+        # Add quota info to response; actual_result aliases into result_dict,
+        # so one dump covers both
+        actual_result["quota_info"] = {
             "total_used": quota_info.get("total_count", 0) + (1 if root_task_id else 0),
             "total_limit": quota_info.get("total_limit"),
             "llm_used": quota_info.get("llm_count", 0) + (1 if is_llm_consuming and root_task_id else 0),
             "llm_limit": quota_info.get("llm_limit"),
         }
-        
-        # Update result with quota info
-        if isinstance(actual_result, dict):
-            actual_result["quota_info"] = quota_info_dict
-        
-        # Return updated response (preserve original format)
-        if isinstance(response, JSONResponse):
-            # Update the JSONResponse content
-            if isinstance(result_dict, dict) and "result" in result_dict:
-                result_dict["result"] = actual_result
-            return JSONResponse(content=result_dict)
+        return orjson.dumps(result_dict)
+
+    async def _is_existing_task_tree(self, task_id: str, memo: Dict[str, bool]) -> bool:
+        """
+        Check if task tree already exists in database
+
+        Args:
+            task_id: Root task ID
+            memo: Per-request results, so the response path reuses the dispatch check
+        """
+        if task_id in memo:
+            return memo[task_id]
+
+        expires_at = _existing_task_trees.get(task_id)
+        if expires_at is not None and expires_at > time.monotonic():
+            exists = True
         else:
-            # Return dict directly (if parent returns dict)
-            return result_dict if isinstance(result_dict, dict) and "result" in result_dict else actual_result
-    
-    async def _is_existing_task_tree(self, task_id: str) -> bool:
-        """Check if task tree already exists in database"""
+            exists = await self._query_task_exists(task_id)
+            if exists:
+                if len(_existing_task_trees) >= _EXISTING_TASK_TREES_MAX:
+                    _existing_task_trees.clear()
+                _existing_task_trees[task_id] = time.monotonic() + _EXISTING_TASK_TREE_TTL
+
+        memo[task_id] = exists
+        return exists
+
+    async def _query_task_exists(self, task_id: str) -> bool:
+        """Probe the task table by primary key without loading the task"""
         try:
-            from apflow.core.storage import create_pooled_session
-            from apflow.core.storage.sqlalchemy.task_repository import TaskRepository
+            from sqlalchemy import select
+            from sqlalchemy.ext.asyncio import AsyncSession
             from apflow.core.config import get_task_model_class
-            
-            async with create_pooled_session() as db_session:
-                task_repository = TaskRepository(db_session, task_model_class=get_task_model_class())
-                task = await task_repository.get_task_by_id(task_id)
-                return task is not None
+
+            task_model = get_task_model_class()
+            stmt = select(task_model.id).where(task_model.id == task_id).limit(1)
+            async with pooled_session() as db_session:
+                if isinstance(db_session, AsyncSession):
+                    result = await db_session.execute(stmt)
+                else:
+                    result = db_session.execute(stmt)
+                return result.first() is not None
         except Exception:
             return False
     
-    def _get_reset_time(self) -> str:
-        """Get quota reset time (midnight UTC)"""
-        from datetime import datetime, timezone, timedelta
-        now = datetime.now(timezone.utc)
-        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        return tomorrow.isoformat()
-
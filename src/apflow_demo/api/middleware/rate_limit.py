@@ -5,6 +5,7 @@ Rate limiting middleware
 from fastapi import Request, HTTPException, status
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
+from starlette.types import Receive, Scope, Send
 from apflow_demo.extensions.rate_limiter import RateLimiter
 from apflow_demo.config.settings import settings
 
@@ -12,17 +13,23 @@ from apflow_demo.config.settings import settings
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """Middleware for rate limiting"""
     
+    # Skip rate limiting for these path prefixes (public and static paths)
+    SKIP_PREFIXES = ("/health", "/docs", "/openapi.json", "/redoc", "/static", "/assets", "/favicon")
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Skipped requests bypass BaseHTTPMiddleware's task and stream setup entirely
+        if (
+            scope["type"] != "http"
+            or not settings.rate_limit_enabled
+            or scope["path"].startswith(self.SKIP_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+    
     async def dispatch(self, request: Request, call_next):
         """Check rate limit before processing request"""
         
-        # Skip rate limiting for certain paths
-        skip_paths = ["/health", "/docs", "/openapi.json", "/redoc"]
-        if any(request.url.path.startswith(path) for path in skip_paths):
-            return await call_next(request)
-        
-        if not settings.rate_limit_enabled:
-            return await call_next(request)
-        
         # Extract user ID and IP
         user_id = None
         # Try to get user ID from JWT token or header
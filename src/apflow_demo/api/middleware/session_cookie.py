@@ -6,18 +6,43 @@ Uses browser fingerprinting to generate stable user IDs, then creates JWT tokens
 that are compatible with apflow's JWT middleware.
 """
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from apflow_demo.utils.user_identification import get_or_create_user_id
-from apflow_demo.utils.jwt_utils import generate_demo_jwt_token, get_user_id_from_token
+import asyncio
+from typing import Dict, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import cookie_parser
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from apflow_demo.utils.user_identification import generate_user_id_from_fingerprint
+from apflow_demo.utils.jwt_utils import get_demo_jwt_token, get_user_id_from_token
 from apflow_demo.config.settings import settings
 from apflow_demo.services.user_service import user_tracking_service
 from apflow.logger import get_logger
 
 logger = get_logger(__name__)
 
+# In-flight activity tracking per user_id. Holds references so pending tasks
+# are not garbage collected, and coalesces bursts from the same user into a
+# single database write.
+_tracking_tasks: Dict[str, asyncio.Task] = {}
 
-class SessionCookieMiddleware(BaseHTTPMiddleware):
+
+async def _track_user_activity(user_id: str, user_agent: Optional[str]) -> None:
+    try:
+        await user_tracking_service.track_user_activity(user_id, source="web", user_agent=user_agent)
+    except Exception as e:
+        logger.error(f"Failed to track user activity: {e}")
+
+
+def _schedule_user_tracking(user_id: str, user_agent: Optional[str]) -> None:
+    """Track user activity in the background, at most once in flight per user"""
+    if not user_id or user_id in _tracking_tasks:
+        return
+    task = asyncio.create_task(_track_user_activity(user_id, user_agent))
+    _tracking_tasks[user_id] = task
+    task.add_done_callback(lambda _: _tracking_tasks.pop(user_id, None))
+
+
+class SessionCookieMiddleware:
     """
     Set demo JWT token cookie for persistent user identification
     
@@ -34,13 +59,19 @@ class SessionCookieMiddleware(BaseHTTPMiddleware):
     - max_age=1 year: Persistent identification
     - samesite=lax: CSRF protection
     - secure: Set based on environment (HTTPS in production)
+    
+    Implemented as a plain ASGI middleware; CORS preflights, static
+    asset paths and health checks bypass it entirely.
     """
     
-    def __init__(self, app, secret_key: str = None):
-        super().__init__(app)
+    # Paths that never need a session (static assets, health checks)
+    BYPASS_PREFIXES = ("/static", "/assets", "/favicon", "/health")
+    
+    def __init__(self, app: ASGIApp, secret_key: str = None):
+        self.app = app
         self.secret_key = secret_key
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """
         Process request and set JWT token cookie if needed
         
@@ -49,7 +80,7 @@ class SessionCookieMiddleware(BaseHTTPMiddleware):
         2. If not, generate user_id from browser fingerprint and create JWT token
         3. Store JWT token in cookie (apflow's JWT middleware reads from cookie automatically)
         
-        This middleware processes ALL requests, including /auth/auto-login endpoint.
+        This middleware processes all API requests, including /auth/auto-login endpoint.
         When webapp calls /auth/auto-login on startup, this middleware will:
         - Generate user_id from browser fingerprint (if cookie doesn't exist)
         - Create JWT token with user_id
@@ -58,51 +89,64 @@ class SessionCookieMiddleware(BaseHTTPMiddleware):
         
         Note: No need to modify Authorization header - apflow now supports cookie-based auth.
         """
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "OPTIONS"
+            or scope["path"].startswith(self.BYPASS_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        headers = Headers(scope=scope)
+        
         # Check if JWT token exists in cookie
-        jwt_token = request.cookies.get("authorization")
-        user_id = None
-        new_token_generated = False
+        cookie_header = headers.get("cookie")
+        jwt_token = cookie_parser(cookie_header).get("authorization") if cookie_header else None
         
         if jwt_token:
             # Extract user_id from existing token (for logging)
             user_id = get_user_id_from_token(jwt_token)
+            set_cookie_header = None
         else:
             # No token exists, generate new one from browser fingerprint
             # This creates a stable user_id based on browser characteristics
-            from apflow_demo.utils.user_identification import generate_user_id_from_fingerprint
-            user_id = generate_user_id_from_fingerprint(request.headers)
-            jwt_token = generate_demo_jwt_token(user_id, expires_in_days=365)
-            new_token_generated = True
+            user_id = generate_user_id_from_fingerprint(headers)
+            jwt_token = get_demo_jwt_token(user_id, expires_in_days=365)
+            set_cookie_header = _authorization_cookie_header(jwt_token)
             logger.debug(f"Generated new JWT token from fingerprint for user: {user_id[:20]}...")
         
-        # Track user activity (async)
-        # We don't necessarily need to await it if we don't want to block the request,
-        # but for demo purposes it's safer to ensure the user exists.
-        try:
-            user_agent = request.headers.get("user-agent")
-            await user_tracking_service.track_user_activity(user_id, source="web", user_agent=user_agent)
-        except Exception as e:
-            logger.error(f"Failed to track user activity: {e}")
+        # Track user activity in the background (best effort, off the request path)
+        _schedule_user_tracking(user_id, headers.get("user-agent"))
         
         # Process request (apflow's JWT middleware will read token from cookie automatically)
-        response = await call_next(request)
+        if set_cookie_header is None:
+            await self.app(scope, receive, send)
+            return
         
-        # Set cookie if not already set or if new token was generated (persistent for 1 year)
-        if (new_token_generated or "authorization" not in request.cookies) and jwt_token:
-            # Determine secure flag based on environment
-            # In production with HTTPS, set secure=True
-            secure = settings.apflow_base_url and settings.apflow_base_url.startswith("https")
-            
-            response.set_cookie(
-                key="authorization",
-                value=jwt_token,
-                max_age=365 * 24 * 60 * 60,  # 1 year (365 days)
-                httponly=True,  # Prevent JavaScript access
-                samesite="lax",  # CSRF protection
-                secure=secure,  # HTTPS only in production
-                path="/",  # Available for all paths
-            )
-            logger.debug(f"Set authorization cookie for user: {user_id[:20] if user_id else 'unknown'}... (httponly, 1 year)")
+        async def send_with_cookie(message: Message) -> None:
+            # Set cookie for the newly generated token (persistent for 1 year)
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("set-cookie", set_cookie_header)
+                logger.debug(f"Set authorization cookie for user: {user_id[:20] if user_id else 'unknown'}... (httponly, 1 year)")
+            await send(message)
         
-        return response
+        await self.app(scope, receive, send_with_cookie)
 
+
+def _authorization_cookie_header(jwt_token: str) -> str:
+    """Build the Set-Cookie header value for the authorization cookie"""
+    # Determine secure flag based on environment
+    # In production with HTTPS, set secure=True
+    secure = bool(settings.apflow_base_url and settings.apflow_base_url.startswith("https"))
+    
+    response = Response()
+    response.set_cookie(
+        key="authorization",
+        value=jwt_token,
+        max_age=365 * 24 * 60 * 60,  # 1 year (365 days)
+        httponly=True,  # Prevent JavaScript access
+        samesite="lax",  # CSRF protection
+        secure=secure,  # HTTPS only in production
+        path="/",  # Available for all paths
+    )
+    return response.headers["set-cookie"]
@@ -5,13 +5,26 @@ Provides endpoints for initializing demo tasks for users.
 """
 
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from apflow_demo.services.demo_init import DemoInitService
 from apflow_demo.utils.header_utils import extract_user_id_from_request
 from apflow.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Response body when the caller cannot be identified
+_USER_ID_NOT_FOUND = {
+    "success": False,
+    "error": "user_id_not_found",
+    "message": "Unable to identify user. Please ensure authentication is configured.",
+}
+
+
+def _user_id_not_found() -> ORJSONResponse:
+    """400 response shared by routes that need a user_id"""
+    logger.error("Failed to extract user_id from request")
+    return ORJSONResponse(status_code=400, content=_USER_ID_NOT_FOUND)
+
 
 class DemoRoutes:
     """Routes for demo task initialization"""
@@ -20,7 +33,7 @@ class DemoRoutes:
         """Initialize demo routes with service"""
         self.demo_init_service = DemoInitService()
 
-    async def handle_check_demo_init_status(self, request: Request) -> JSONResponse:
+    async def handle_check_demo_init_status(self, request: Request) -> ORJSONResponse:
         """
         Handle demo init status check request
         
@@ -35,27 +48,19 @@ class DemoRoutes:
            - Details for each executor
         
         Returns:
-            JSONResponse with status information
+            ORJSONResponse with status information
         """
         try:
             # Extract user_id from request (JWT/cookie/browser fingerprint)
             user_id = extract_user_id_from_request(request)
             
             if not user_id:
-                logger.error("Failed to extract user_id from request")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "user_id_not_found",
-                        "message": "Unable to identify user. Please ensure authentication is configured.",
-                    }
-                )
+                return _user_id_not_found()
             
             # Check demo init status
             status = await self.demo_init_service.check_demo_init_status(user_id)
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=200,
                 content={
                     "success": True,
@@ -74,7 +79,7 @@ class DemoRoutes:
             
         except Exception as e:
             logger.error(f"Error checking demo init status: {e}", exc_info=True)
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "success": False,
@@ -83,7 +88,7 @@ class DemoRoutes:
                 }
             )
 
-    async def handle_init_executor_demo_tasks(self, request: Request) -> JSONResponse:
+    async def handle_init_executor_demo_tasks(self, request: Request) -> ORJSONResponse:
         """
         Handle executor demo task initialization request
         
@@ -103,22 +108,14 @@ class DemoRoutes:
         The created tasks will appear in the normal task list via apflow's standard API.
         
         Returns:
-            JSONResponse with success status, created_count, task_ids, and message
+            ORJSONResponse with success status, created_count, task_ids, and message
         """
         try:
             # Extract user_id from request (JWT/cookie/browser fingerprint)
             user_id = extract_user_id_from_request(request)
             
             if not user_id:
-                logger.error("Failed to extract user_id from request")
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": "user_id_not_found",
-                        "message": "Unable to identify user. Please ensure authentication is configured.",
-                    }
-                )
+                return _user_id_not_found()
             
             logger.info(f"Initializing executor demo tasks for user: {user_id[:20]}...")
             
@@ -126,7 +123,7 @@ class DemoRoutes:
             created_task_ids = await self.demo_init_service.init_executor_demo_tasks_for_user(user_id)
             
             if not created_task_ids:
-                return JSONResponse(
+                return ORJSONResponse(
                     status_code=200,
                     content={
                         "success": True,
@@ -138,7 +135,7 @@ class DemoRoutes:
             
             logger.info(f"Successfully initialized {len(created_task_ids)} executor demo tasks for user: {user_id[:20]}...")
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=200,
                 content={
                     "success": True,
@@ -150,7 +147,7 @@ class DemoRoutes:
             
         except Exception as e:
             logger.error(f"Error initializing executor demo tasks: {e}", exc_info=True)
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "success": False,
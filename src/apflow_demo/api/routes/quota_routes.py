@@ -10,13 +10,13 @@ from starlette.responses import JSONResponse
 from fastapi import HTTPException, status
 
 from apflow_demo.extensions.rate_limiter import RateLimiter
+from apflow_demo.storage.quota_repository import quota_reset_iso
 from apflow_demo.utils.header_utils import (
     has_llm_key_in_header,
     extract_user_id_from_request,
 )
 from apflow_demo.config.settings import settings
 from apflow.logger import get_logger
-from datetime import datetime, timezone
 
 logger = get_logger(__name__)
 
@@ -41,17 +41,12 @@ class QuotaRoutes:
                 has_llm_key=is_premium,
             )
             
-            # Add reset time
-            from datetime import timedelta
-            now = datetime.now(timezone.utc)
-            tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-            
             return JSONResponse(
                 content={
                     "user_id": user_id,
                     "quota": {
                         **quota_status,
-                        "reset_time": tomorrow.isoformat(),
+                        "reset_time": quota_reset_iso(),
                     },
                     "is_premium": is_premium,
                 }
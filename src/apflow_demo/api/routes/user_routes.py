@@ -4,15 +4,155 @@ User management routes for demo application
 Provides API endpoints for querying user information.
 """
 
+import asyncio
+import base64
+import logging
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
+import orjson
+import yaml
+from sqlalchemy import select
+from sqlalchemy.sql import desc
+from sqlalchemy_session_proxy import SqlalchemySessionProxy
 from starlette.requests import Request
-from starlette.responses import JSONResponse
-from typing import Optional
+from fastapi.responses import ORJSONResponse
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from apflow.core.storage import create_pooled_session
+from apflow_demo.config.settings import settings
 from apflow_demo.services.user_service import user_tracking_service
-from apflow_demo.utils.jwt_utils import verify_demo_jwt_token
+from apflow_demo.storage.models import DemoUser
+from apflow_demo.utils.jwt_utils import verify_demo_jwt_token, verify_token_cached
 from apflow.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Parsed config.cli.yaml keyed by path: (mtime, size, config)
+_cli_config_cache: Dict[str, Tuple[float, int, Any]] = {}
+# Last _load_cli_config() result, revalidated after _CLI_CONFIG_TTL seconds
+_cli_config: Tuple[Optional[Path], Optional[Dict[str, Any]]] = (None, None)
+_cli_config_checked_at = float("-inf")
+_CLI_CONFIG_TTL = 5
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Columns returned by /api/users/list
+_USER_LIST_COLUMNS = (
+    DemoUser.user_id,
+    DemoUser.username,
+    DemoUser.status,
+    DemoUser.last_active_at,
+    DemoUser.source,
+    DemoUser.user_agent,
+    DemoUser.created_at,
+)
+
+# In-flight admin queries keyed by (query, *args)
+_inflight_queries: Dict[tuple, asyncio.Future] = {}
+
+# /api/users/stats results per period: period -> (expiry, stats), so
+# dashboards polling the endpoint do not query the database every time
+_stats_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_STATS_CACHE_TTL = 5
+
+
+def _claims_admin_role(token: str) -> bool:
+    """
+    Unverified pre-check: token is a three-segment JWT whose payload claims role=admin
+
+    Only used to short-circuit rejection; acceptance still requires a
+    verified signature.
+    """
+    if token.count(".") != 2:
+        return False
+    segment = token.split(".")[1]
+    try:
+        claims = orjson.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))
+    except ValueError:
+        return False
+    return isinstance(claims, dict) and claims.get("role") == "admin"
+
+
+@lru_cache(maxsize=1)
+def _api_jwt_config() -> Optional[Tuple[str, str]]:
+    """
+    API server JWT (secret, algorithm), or None when .env sets no APFLOW_JWT_SECRET
+
+    Resolved once: the environment and settings are fixed for the process lifetime.
+    """
+    if not os.getenv("APFLOW_JWT_SECRET") or not settings.apflow_jwt_secret_key:
+        return None
+    return settings.apflow_jwt_secret_key, settings.apflow_jwt_algorithm
+
+
+def _stat_cli_config() -> Optional[Tuple[Path, os.stat_result]]:
+    """Return the first existing config.cli.yaml with its stat, one stat() per candidate"""
+    # Try multiple possible locations for config.cli.yaml
+    possible_paths = (
+        Path.cwd() / ".data" / "config.cli.yaml",  # Project-specific
+        Path.cwd() / "config.cli.yaml",  # Project root
+        Path.home() / ".apflow" / "config.cli.yaml",  # User home
+    )
+    for path in possible_paths:
+        try:
+            return path, path.stat()
+        except OSError:
+            continue
+    return None
+
+
+def _load_cli_config() -> Tuple[Optional[Path], Optional[Dict[str, Any]]]:
+    """
+    Load config.cli.yaml
+
+    The location and file are re-checked at most every _CLI_CONFIG_TTL
+    seconds, and the file is reparsed only when its mtime or size changes,
+    so CLI secret rotation is picked up without touching the filesystem on
+    every request.
+
+    Returns:
+        Tuple of (config path or None if not found, parsed config)
+    """
+    global _cli_config, _cli_config_checked_at
+
+    now = time.monotonic()
+    if now - _cli_config_checked_at < _CLI_CONFIG_TTL:
+        return _cli_config
+
+    config_path = None
+    cli_config = None
+    found = _stat_cli_config()
+    if found is not None:
+        config_path, stat = found
+        cached = _cli_config_cache.get(str(config_path))
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            cli_config = cached[2]
+        else:
+            with open(config_path, "r") as f:
+                cli_config = yaml.load(f, Loader=_YamlLoader)
+            _cli_config_cache[str(config_path)] = (stat.st_mtime, stat.st_size, cli_config)
+
+    _cli_config = (config_path, cli_config)
+    _cli_config_checked_at = now
+    return _cli_config
+
+
+async def _coalesced(key: tuple, query: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run query, sharing one execution among concurrent callers with the same key
+
+    Dashboards tend to fire identical list/stats requests together; those
+    that arrive while a query is in flight await its result instead of
+    issuing their own round-trip.
+    """
+    future = _inflight_queries.get(key)
+    if future is None:
+        future = asyncio.ensure_future(query())
+        _inflight_queries[key] = future
+        future.add_done_callback(lambda _: _inflight_queries.pop(key, None))
+    # A cancelled caller must not cancel the query for the others
+    return await asyncio.shield(future)
+
 
 def _check_admin_auth(request: Request) -> bool:
     """
@@ -23,11 +163,6 @@ def _check_admin_auth(request: Request) -> bool:
     
     If .env has no APFLOW_JWT_SECRET, allows admin tokens from CLI config.
     """
-    from apflow.api.a2a.server import verify_token
-    from pathlib import Path
-    import yaml
-    import os
-    
     # Get token from Authorization header or cookie
     token = None
     auth_header = request.headers.get("Authorization")
@@ -39,60 +174,51 @@ def _check_admin_auth(request: Request) -> bool:
     if not token:
         logger.debug("No token found in Authorization header or cookie")
         return False
+
+    # Reject malformed and non-admin tokens before paying for signature checks
+    if not _claims_admin_role(token):
+        logger.debug("Token is malformed or does not claim the admin role")
+        return False
     
-    # Check if .env has APFLOW_JWT_SECRET set (not using default)
-    from apflow_demo.config.settings import settings
-    env_has_jwt_secret = bool(
-        os.getenv("APFLOW_JWT_SECRET")
-    )
+    # API server's JWT secret applies only if .env sets APFLOW_JWT_SECRET (not using default)
+    api_jwt_config = _api_jwt_config()
     
-    logger.debug(f"Checking admin auth: env_has_jwt_secret={env_has_jwt_secret}, token_prefix={token[:20] if token else None}...")
+    # Lazy %-formatting: nothing is formatted unless debug logging is enabled
+    logger.debug(
+        "Checking admin auth: env_has_jwt_secret=%s, token_prefix=%s...",
+        api_jwt_config is not None, token[:20],
+    )
     
     # Try API server's JWT secret first (if configured)
-    if env_has_jwt_secret:
-        api_secret = settings.apflow_jwt_secret_key
-        api_algorithm = settings.apflow_jwt_algorithm
-        if api_secret:
-            payload = verify_token(token, api_secret, api_algorithm)
-            if payload and payload.get("role") == "admin":
-                logger.debug("Admin auth successful with API server JWT secret")
-                return True
-            else:
-                logger.debug(f"Token verification with API secret failed: payload={payload}")
+    if api_jwt_config:
+        api_secret, api_algorithm = api_jwt_config
+        payload = verify_token_cached(token, api_secret, api_algorithm)
+        if payload and payload.get("role") == "admin":
+            logger.debug("Admin auth successful with API server JWT secret")
+            return True
+        else:
+            logger.debug("Token verification with API secret failed: payload=%s", payload)
     
     # Always try CLI's JWT secret (from config.cli.yaml)
     # This is needed when CLI generates tokens with its own secret
     # Even if .env has APFLOW_JWT_SECRET, CLI tokens may use different secret
     try:
-        # Try multiple possible locations for config.cli.yaml
-        possible_paths = [
-            Path.cwd() / ".data" / "config.cli.yaml",  # Project-specific
-            Path.cwd() / "config.cli.yaml",  # Project root
-            Path.home() / ".apflow" / "config.cli.yaml",  # User home
-        ]
-        
-        config_path = None
-        for path in possible_paths:
-            if path.exists():
-                config_path = path
-                break
-        
+        config_path, cli_config = _load_cli_config()
         if config_path:
-            with open(config_path, "r") as f:
-                cli_config = yaml.safe_load(f)
-                if cli_config and "jwt_secret" in cli_config:
-                    cli_secret = cli_config["jwt_secret"]
-                    cli_algorithm = cli_config.get("jwt_algorithm", "HS256")
-                    payload = verify_token(token, cli_secret, cli_algorithm)
-                    if payload and payload.get("role") == "admin":
-                        logger.debug(f"Admin auth successful with CLI JWT secret from {config_path}")
-                        return True
-                    else:
-                        logger.debug(f"Token verification with CLI secret failed: payload={payload}")
+            if cli_config and "jwt_secret" in cli_config:
+                cli_secret = cli_config["jwt_secret"]
+                cli_algorithm = cli_config.get("jwt_algorithm", "HS256")
+                payload = verify_token_cached(token, cli_secret, cli_algorithm)
+                if payload and payload.get("role") == "admin":
+                    logger.debug("Admin auth successful with CLI JWT secret from %s", config_path)
+                    return True
+                else:
+                    logger.debug("Token verification with CLI secret failed: payload=%s", payload)
         else:
             logger.debug("config.cli.yaml not found in any standard location")
     except Exception as e:
-        logger.warning(f"Failed to check CLI JWT secret: {e}", exc_info=True)
+        # Full traceback only when debugging; the message already names the error
+        logger.warning(f"Failed to check CLI JWT secret: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
     
     logger.debug("Admin authentication failed - no valid admin token found")
     return False
@@ -106,7 +232,7 @@ class UserRoutes:
         request: Request,
         limit: int = 20,
         status: Optional[str] = None,
-    ) -> JSONResponse:
+    ) -> ORJSONResponse:
         """
         Handle user list request
         
@@ -115,11 +241,11 @@ class UserRoutes:
         Requires admin authentication via Bearer token or cookie.
         
         Returns:
-            JSONResponse with list of users
+            ORJSONResponse with list of users
         """
         # Check admin authentication
         if not _check_admin_auth(request):
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=401,
                 content={
                     "success": False,
@@ -129,40 +255,33 @@ class UserRoutes:
             )
         
         try:
-            from sqlalchemy import select
-            from sqlalchemy.sql import desc
-            from apflow.core.storage import create_pooled_session
-            from apflow_demo.storage.models import DemoUser
-            from sqlalchemy.ext.asyncio import AsyncSession
-
             async def _list_users():
+                # Select only the listed columns: rows, not ORM entities
+                stmt = select(*_USER_LIST_COLUMNS).order_by(desc(DemoUser.last_active_at)).limit(limit)
+                if status:
+                    stmt = stmt.where(DemoUser.status == status)
+
                 async with create_pooled_session() as session:
-                    stmt = select(DemoUser).order_by(desc(DemoUser.last_active_at)).limit(limit)
-                    if status:
-                        stmt = stmt.where(DemoUser.status == status)
-                    
-                    if isinstance(session, AsyncSession):
-                        result = await session.execute(stmt)
-                        return result.scalars().all()
-                    else:
-                        result = session.execute(stmt)
-                        return result.scalars().all()
-
-            users = await _list_users()
+                    result = await SqlalchemySessionProxy(session).execute(stmt)
+                    return result.all()
+
+            users = await _coalesced(("list", limit, status), _list_users)
             
-            users_data = []
-            for user in users:
-                users_data.append({
+            # orjson serializes datetimes (ISO 8601) and None natively
+            users_data = [
+                {
                     "user_id": user.user_id,
                     "username": user.username,
                     "status": user.status,
-                    "last_active_at": user.last_active_at.isoformat() if user.last_active_at else None,
+                    "last_active_at": user.last_active_at,
                     "source": user.source,
                     "user_agent": user.user_agent,
-                    "created_at": user.created_at.isoformat() if user.created_at else None,
-                })
+                    "created_at": user.created_at,
+                }
+                for user in users
+            ]
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=200,
                 content={
                     "success": True,
@@ -173,7 +292,7 @@ class UserRoutes:
             
         except Exception as e:
             logger.error(f"Error listing users: {e}", exc_info=True)
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "success": False,
@@ -186,7 +305,7 @@ class UserRoutes:
         self,
         request: Request,
         period: str = "all",
-    ) -> JSONResponse:
+    ) -> ORJSONResponse:
         """
         Handle user statistics request
         
@@ -195,11 +314,11 @@ class UserRoutes:
         Requires admin authentication via Bearer token or cookie.
         
         Returns:
-            JSONResponse with user statistics
+            ORJSONResponse with user statistics
         """
         # Check admin authentication
         if not _check_admin_auth(request):
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=401,
                 content={
                     "success": False,
@@ -209,9 +328,16 @@ class UserRoutes:
             )
         
         try:
-            stats = await user_tracking_service.get_user_stats(period)
+            cached = _stats_cache.get(period)
+            if cached is not None and cached[0] > time.monotonic():
+                stats = cached[1]
+            else:
+                stats = await _coalesced(
+                    ("stats", period), lambda: user_tracking_service.get_user_stats(period)
+                )
+                _stats_cache[period] = (time.monotonic() + _STATS_CACHE_TTL, stats)
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=200,
                 content={
                     "success": True,
@@ -221,7 +347,7 @@ class UserRoutes:
             
         except Exception as e:
             logger.error(f"Error getting user stats: {e}", exc_info=True)
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "success": False,
@@ -6,9 +6,11 @@ Wraps apflow API with demo-specific middleware and quota-aware routes.
 Uses apflow's create_runnable_app() directly with all configuration.
 """
 
+import inspect
 import os
 from contextlib import asynccontextmanager
-from typing import Any, AsyncGenerator, List
+from typing import Any, AsyncGenerator, Awaitable, Callable, List, Optional
+from starlette.applications import Starlette
 from starlette.routing import Route
 from starlette.requests import Request
 from apflow.api.main import create_runnable_app
@@ -16,6 +18,10 @@ from apflow_demo.api.middleware.rate_limit import RateLimitMiddleware
 from apflow_demo.api.middleware.demo_mode import DemoModeMiddleware
 from apflow_demo.api.middleware.session_cookie import SessionCookieMiddleware
 from apflow_demo.api.middleware.quota_limit import QuotaLimitMiddleware
+from apflow_demo.api.middleware.compression import CompressionMiddleware
+from apflow_demo.services.user_service import init_demo_schema
+from apflow_demo.storage.counter_flusher import counter_flusher
+from apflow_demo.storage.migrations import migrate_demo_schema
 from apflow_demo.utils.jwt_utils import verify_demo_jwt_token
 from apflow_demo.config.settings import settings
 from apflow.logger import get_logger
@@ -92,26 +98,15 @@ def _create_custom_routes() -> List[Route]:
     from apflow_demo.api.routes.executor_routes import ExecutorRoutes
     executor_routes = ExecutorRoutes()
     
+    async def all_executor_metadata_handler(request: Request):
+        return await executor_routes.handle_all_executor_metadata(request)
+    
     async def executor_metadata_handler(request: Request):
-        # Extract executor_id from URL path
         # Path format: /api/executors/metadata/{executor_id}
-        path = request.url.path
-        if path == "/api/executors/metadata":
-            # Handle all executors metadata
-            return await executor_routes.handle_all_executor_metadata(request)
-        elif path.startswith("/api/executors/metadata/"):
-            # Handle specific executor metadata
-            executor_id = path.replace("/api/executors/metadata/", "", 1)
-            if executor_id:
-                return await executor_routes.handle_executor_metadata(request, executor_id)
-        # If path doesn't match, return error
-        from starlette.responses import JSONResponse
-        return JSONResponse(
-            status_code=404,
-            content={"error": "Not found"}
-        )
-    
-    routes.append(Route("/api/executors/metadata", executor_metadata_handler, methods=["GET"]))
+        executor_id = request.path_params["executor_id"]
+        return await executor_routes.handle_executor_metadata(request, executor_id)
+    
+    routes.append(Route("/api/executors/metadata", all_executor_metadata_handler, methods=["GET"]))
     routes.append(Route("/api/executors/metadata/{executor_id}", executor_metadata_handler, methods=["GET"]))
     logger.info("Added executor metadata routes: /api/executors/metadata, /api/executors/metadata/{executor_id}")
     
@@ -145,9 +140,44 @@ def _create_custom_middleware() -> List:
     if settings.rate_limit_enabled:
         middleware.append(RateLimitMiddleware)
     
+    # Compression middleware (outermost, gzips large demo API responses)
+    middleware.append(CompressionMiddleware)
+    
     return middleware
 
 
+def _resolve_engine_dispose() -> Optional[Callable[[], Awaitable[None]]]:
+    """
+    Resolve the coroutine that closes the database connection pool
+
+    Resolved at startup so shutdown needs no lookups: uses apflow's default
+    engine, falling back to the default session's bind.
+    """
+    engine = None
+    try:
+        from apflow.core.storage import get_default_engine
+        engine = get_default_engine()
+    except (ImportError, AttributeError):
+        try:
+            from apflow.core.storage import get_default_session
+            engine = getattr(get_default_session(), "bind", None)
+        except Exception:
+            pass
+    except Exception as e:
+        logger.warning(f"Could not resolve database engine for shutdown: {e}")
+
+    dispose = getattr(engine, "dispose", None)
+    if not callable(dispose):
+        return None
+    if inspect.iscoroutinefunction(dispose):
+        return dispose
+
+    async def _dispose() -> None:
+        dispose()
+
+    return _dispose
+
+
 @asynccontextmanager
 async def _app_lifespan(app: Any) -> AsyncGenerator[None, None]:
     """
@@ -157,52 +187,58 @@ async def _app_lifespan(app: Any) -> AsyncGenerator[None, None]:
     """
     # Startup
     logger.info("Application startup")
+    try:
+        # Create demo tables once instead of on every tracked request
+        await init_demo_schema()
+        await migrate_demo_schema()
+    except Exception as e:
+        logger.error(f"Failed to initialize demo schema: {e}")
+    dispose_engine = _resolve_engine_dispose()
     yield
     
     # Shutdown - cleanup database connections
     logger.info("Application shutdown - cleaning up resources")
     try:
-        # Try to get engine and close connections
-        # First try get_default_engine if it exists
-        try:
-            from apflow.core.storage import get_default_engine
-            engine = get_default_engine()
-            if engine is not None:
-                # Close all connections in the pool
-                if hasattr(engine, "dispose"):
-                    if hasattr(engine.dispose, "__call__"):
-                        # Check if it's async
-                        import inspect
-                        if inspect.iscoroutinefunction(engine.dispose):
-                            await engine.dispose()
-                        else:
-                            engine.dispose()
-                    else:
-                        engine.dispose()
-                logger.info("Database connection pool closed")
-        except (ImportError, AttributeError):
-            # If get_default_engine doesn't exist, try to get engine from session
-            try:
-                from apflow.core.storage import get_default_session
-                session = get_default_session()
-                if session is not None and hasattr(session, "bind"):
-                    engine = session.bind
-                    if engine is not None and hasattr(engine, "dispose"):
-                        if hasattr(engine.dispose, "__call__"):
-                            import inspect
-                            if inspect.iscoroutinefunction(engine.dispose):
-                                await engine.dispose()
-                            else:
-                                engine.dispose()
-                        logger.info("Database connection pool closed via session")
-            except Exception:
-                pass
+        # Write queued counter increments before the pool is disposed
+        await counter_flusher.close()
     except Exception as e:
-        logger.warning(f"Error during shutdown cleanup: {e}")
+        logger.error(f"Failed to flush counters: {e}")
+    if dispose_engine is not None:
+        try:
+            await dispose_engine()
+            logger.info("Database connection pool closed")
+        except Exception as e:
+            logger.warning(f"Error during shutdown cleanup: {e}")
     
     logger.info("Shutdown complete")
 
 
+def _chain_lifespan(original_lifespan: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """Run _app_lifespan inside an app's existing lifespan context"""
+    @asynccontextmanager
+    async def _wrapped_lifespan(app: Any) -> AsyncGenerator[None, None]:
+        async with original_lifespan(app):
+            async with _app_lifespan(app):
+                yield
+    return _wrapped_lifespan
+
+
+def _attach_lifespan(app: Starlette) -> None:
+    """
+    Run _app_lifespan as part of an app's lifespan
+
+    FastAPI subclasses Starlette, so both keep their lifespan on
+    app.router.lifespan_context; an existing one is wrapped, not replaced.
+    """
+    original_lifespan = getattr(app.router, "lifespan_context", None)
+    if original_lifespan is None:
+        # Assign the function itself, not the result of calling it
+        app.router.lifespan_context = _app_lifespan
+    else:
+        app.router.lifespan_context = _chain_lifespan(original_lifespan)
+    logger.debug("Added demo lifespan context manager")
+
+
 def create_demo_app() -> Any:
     """
     Create demo application with middleware and quota-aware routes
@@ -224,9 +260,9 @@ def create_demo_app() -> Any:
     # 1. Convert types (int -> str, bool -> "true"/"false")
     # 2. Ensure default values are set (from settings object)
     # 3. Guarantee variables are set before create_runnable_app() is called
+    # Only touch variables whose value differs (none on warm restarts)
     apflow_env = settings.get_apflow_env()
-    for key, value in apflow_env.items():
-        os.environ[key] = value
+    os.environ.update({key: value for key, value in apflow_env.items() if os.environ.get(key) != value})
     
     logger.info("Creating demo application with apflow's create_runnable_app()")
     
@@ -245,35 +281,10 @@ def create_demo_app() -> Any:
         auto_initialize_extensions=True,  # Automatically initialize extensions
     )
     
-    # Add lifespan context manager for proper resource cleanup on shutdown
-    # This ensures database connections are properly closed when the app shuts down
+    # Add lifespan context manager for schema setup and proper resource
+    # cleanup on shutdown (counter flush, connection pool)
     try:
-        from fastapi import FastAPI
-        from starlette.applications import Starlette
-        
-        if isinstance(app, FastAPI):
-            # FastAPI app - use lifespan parameter
-            # Note: We can't modify lifespan after creation, so we log a warning
-            # The lifespan should ideally be passed to create_runnable_app if it supports it
-            logger.debug("FastAPI app detected - lifespan should be set during app creation")
-        elif isinstance(app, Starlette):
-            # Starlette app - try to set lifespan_context on router
-            # lifespan_context should be a callable that takes app and returns async context manager
-            if hasattr(app, "router"):
-                original_lifespan = getattr(app.router, "lifespan_context", None)
-                if original_lifespan is None:
-                    # Assign the function itself, not the result of calling it
-                    app.router.lifespan_context = _app_lifespan
-                    logger.debug("Added lifespan context manager to Starlette app")
-                else:
-                    # Wrap existing lifespan
-                    @asynccontextmanager
-                    async def _wrapped_lifespan(app: Any) -> AsyncGenerator[None, None]:
-                        async with original_lifespan(app):
-                            async with _app_lifespan(app):
-                                yield
-                    app.router.lifespan_context = _wrapped_lifespan
-                    logger.debug("Wrapped existing lifespan context manager")
+        _attach_lifespan(app)
     except Exception as e:
         logger.warning(f"Could not add lifespan context manager: {e}")
     
@@ -3,19 +3,121 @@ CLI extension for user management and statistics
 """
 
 import asyncio
-import json
-from typing import Optional
+import atexit
+import sys
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
+import orjson
 import typer
 from rich.console import Console
-from rich.table import Table
-from sqlalchemy.ext.asyncio import AsyncSession
 from apflow.cli import CLIExtension, cli_register
-from apflow_demo.services.user_service import user_tracking_service
 
 # Initialize UI
 console = Console()
 
+_VALID_PERIODS = frozenset({"all", "day", "week", "month", "year"})
+_VALID_PERIODS_STR = "all, day, week, month, year"
+
+
+@lru_cache(maxsize=1)
+def _cli_api_target() -> Tuple[Optional[str], Optional[str]]:
+    """Return (api_server_url, admin auth token) from the CLI config, loaded once per process"""
+    from apflow.core.config_manager import get_config_manager
+
+    config_manager = get_config_manager()
+    # Load CLI config to ensure it's read from config.cli.yaml
+    config_manager.load_cli_config()
+    return config_manager.get_api_server_url(), config_manager.get_admin_auth_token()
+
+
+# Keep-alive HTTP clients keyed by (api_server_url, auth_token), so repeated
+# API calls in one process share pooled connections
+_http_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+
+
+def _get_http_client(api_server_url: str, auth_token: Optional[str]) -> Optional[Any]:
+    """
+    Return a pooled httpx.Client for the API server
+
+    Returns None when httpx is not installed.
+    """
+    key = (api_server_url, auth_token)
+    client = _http_clients.get(key)
+    if client is None:
+        try:
+            import httpx
+        except ImportError:
+            return None
+
+        headers = {"Authorization": f"Bearer {auth_token}"} if auth_token else {}
+        client = httpx.Client(
+            base_url=api_server_url,
+            headers=headers,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        atexit.register(client.close)
+        _http_clients[key] = client
+    return client
+
+
+def _print_json(data: Any) -> None:
+    """Write data as indented JSON straight to stdout (no Rich markup pass)"""
+    sys.stdout.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE).decode())
+
+
+def _short_user_id(user_id: str) -> str:
+    """Truncate long user IDs for table display"""
+    return user_id[:20] + "..." if len(user_id) > 20 else user_id
+
+
+def _format_timestamp(value: Optional[str]) -> str:
+    """Render an ISO 8601 timestamp as 'YYYY-MM-DD HH:MM:SS' (N/A when missing)"""
+    if not value:
+        return "N/A"
+    # Fast path: 'YYYY-MM-DDTHH:MM:SS' optionally followed by fraction/offset,
+    # where the wanted text is already the first 19 characters
+    if len(value) >= 19 and value[10] == "T" and value[19:20] in ("", ".", "Z", "+", "-"):
+        return value[:10] + " " + value[11:19]
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def _list_users_db(limit: int, status: Optional[str]) -> List[Dict[str, Any]]:
+    """Fetch the latest active demo users straight from the database, as dicts"""
+    from sqlalchemy import select
+    from sqlalchemy.sql import desc
+    from sqlalchemy_session_proxy import SqlalchemySessionProxy
+    from apflow.core.storage import create_pooled_session
+    from apflow_demo.storage.models import DemoUser
+
+    # Plain column rows, no ORM instances to build
+    stmt = select(
+        DemoUser.user_id,
+        DemoUser.username,
+        DemoUser.status,
+        DemoUser.last_active_at,
+        DemoUser.source,
+        DemoUser.user_agent,
+        DemoUser.created_at,
+    ).order_by(desc(DemoUser.last_active_at)).limit(limit)
+    if status:
+        stmt = stmt.where(DemoUser.status == status)
+
+    async with create_pooled_session() as session:
+        # The proxy awaits async sessions and calls sync ones directly
+        result = await SqlalchemySessionProxy(session).execute(stmt)
+        rows = result.all()
+
+    users = [dict(row._mapping) for row in rows]
+    for user in users:
+        last_active_at, created_at = user["last_active_at"], user["created_at"]
+        user["last_active_at"] = last_active_at.isoformat() if last_active_at else None
+        user["created_at"] = created_at.isoformat() if created_at else None
+    return users
+
+
 # Create and register the command group using decorator
 # This automatically registers with apflow CLI without entry points
 
@@ -45,36 +147,20 @@ class UsersApp(CLIExtension):
         
         Example: apflow users stat day
         """
-        valid_periods = ["all", "day", "week", "month", "year"]
-        if period not in valid_periods:
-            console.print(f"[red]Error:[/red] Invalid period '{period}'. Valid options: {', '.join(valid_periods)}")
+        if period not in _VALID_PERIODS:
+            console.print(f"[red]Error:[/red] Invalid period '{period}'. Valid options: {_VALID_PERIODS_STR}")
             raise typer.Exit(code=1)
 
         try:
             # Try to use API server if configured
-            from apflow.core.config_manager import get_config_manager
-            try:
-                import httpx
-            except ImportError:
-                httpx = None
+            api_server_url, auth_token = _cli_api_target()
+            http_client = _get_http_client(api_server_url, auth_token) if api_server_url else None
             
-            config_manager = get_config_manager()
-            # Load CLI config to ensure it's read from config.cli.yaml
-            config_manager.load_cli_config()
-            api_server_url = config_manager.get_api_server_url()
-            auth_token = config_manager.get_admin_auth_token()
-            
-            if api_server_url and httpx:
+            if http_client is not None:
                 # Use API to query stats
                 try:
-                    url = f"{api_server_url}/api/users/stats"
                     params = {"period": period}
-                    
-                    headers = {}
-                    if auth_token:
-                        headers["Authorization"] = f"Bearer {auth_token}"
-                    
-                    response = httpx.get(url, params=params, headers=headers, timeout=10.0)
+                    response = http_client.get("/api/users/stats", params=params)
                     response.raise_for_status()
                     data = response.json()
                     
@@ -89,20 +175,20 @@ class UsersApp(CLIExtension):
             else:
                 if not api_server_url:
                     console.print(f"[dim]Note:[/dim] API server not configured, using direct database access")
-                elif not httpx:
+                else:
                     console.print(f"[dim]Note:[/dim] httpx not available, using direct database access")
                 stats = None
             
             # Fallback to direct database access if API is not available
             if stats is None:
-                async def _get_stats():
-                    return await user_tracking_service.get_user_stats(period)
-                stats = asyncio.run(_get_stats())
+                from apflow_demo.services.user_service import user_tracking_service
+                stats = asyncio.run(user_tracking_service.get_user_stats(period))
             
             if output_format == "json":
-                console.print(json.dumps(stats, indent=2))
+                _print_json(stats)
                 return
 
+            from rich.table import Table
             table = Table(title=f"User Statistics ({period})")
             table.add_column("Metric", style="cyan")
             table.add_column("Value", style="green")
@@ -132,31 +218,16 @@ class UsersApp(CLIExtension):
         """
         try:
             # Try to use API server if configured
-            from apflow.core.config_manager import get_config_manager
-            try:
-                import httpx
-            except ImportError:
-                httpx = None
+            api_server_url, auth_token = _cli_api_target()
+            http_client = _get_http_client(api_server_url, auth_token) if api_server_url else None
             
-            config_manager = get_config_manager()
-            # Load CLI config to ensure it's read from config.cli.yaml
-            config_manager.load_cli_config()
-            api_server_url = config_manager.get_api_server_url()
-            auth_token = config_manager.get_admin_auth_token()
-            
-            if api_server_url and httpx:
+            if http_client is not None:
                 # Use API to query users
                 try:
-                    url = f"{api_server_url}/api/users/list"
                     params = {"limit": limit}
                     if status:
                         params["status"] = status
-                    
-                    headers = {}
-                    if auth_token:
-                        headers["Authorization"] = f"Bearer {auth_token}"
-                    
-                    response = httpx.get(url, params=params, headers=headers, timeout=10.0)
+                    response = http_client.get("/api/users/list", params=params)
                     response.raise_for_status()
                     data = response.json()
                     
@@ -171,55 +242,26 @@ class UsersApp(CLIExtension):
             else:
                 if not api_server_url:
                     console.print(f"[dim]Note:[/dim] API server not configured, using direct database access")
-                elif not httpx:
+                else:
                     console.print(f"[dim]Note:[/dim] httpx not available, using direct database access")
                 users_data = None
             
             # Fallback to direct database access if API is not available
             if users_data is None:
-                from sqlalchemy import select
-                from sqlalchemy.sql import desc
-                from apflow.core.storage import create_pooled_session
-                from apflow_demo.storage.models import DemoUser
-                from sqlalchemy.ext.asyncio import AsyncSession
-
-                async def _list_users_db():
-                    async with create_pooled_session() as session:
-                        stmt = select(DemoUser).order_by(desc(DemoUser.last_active_at)).limit(limit)
-                        if status:
-                            stmt = stmt.where(DemoUser.status == status)
-                        
-                        if isinstance(session, AsyncSession):
-                            result = await session.execute(stmt)
-                            return result.scalars().all()
-                        else:
-                            result = session.execute(stmt)
-                            return result.scalars().all()
-
-                users_db_objects = asyncio.run(_list_users_db())
-                users_data = []
-                for user in users_db_objects:
-                    users_data.append({
-                        "user_id": user.user_id,
-                        "username": user.username,
-                        "status": user.status,
-                        "last_active_at": user.last_active_at.isoformat() if user.last_active_at else None,
-                        "source": user.source,
-                        "user_agent": user.user_agent,
-                        "created_at": user.created_at.isoformat() if user.created_at else None,
-                    })
+                users_data = asyncio.run(_list_users_db(limit, status))
             
             if not users_data:
                 if output_format == "json":
-                    console.print("[]")
+                    _print_json([])
                 else:
                     console.print("No users found.")
                 return
 
             if output_format == "json":
-                console.print(json.dumps(users_data, indent=2))
+                _print_json(users_data)
                 return
 
+            from rich.table import Table
             table = Table(title=f"Latest Users (Top {limit})")
             table.add_column("User ID", style="dim")
             table.add_column("Username", style="cyan")
@@ -229,25 +271,26 @@ class UsersApp(CLIExtension):
             if show_ua:
                 table.add_column("User-Agent", style="dim")
             
-            for user in users_data:
-                last_active = user.get("last_active_at")
-                if last_active:
-                    from datetime import datetime
-                    dt = datetime.fromisoformat(last_active.replace("Z", "+00:00"))
-                    last_active_str = dt.strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    last_active_str = "N/A"
-                
-                table.add_row(
-                    user["user_id"][:20] + "..." if len(user["user_id"]) > 20 else user["user_id"],
+            # Convert every cell up front (the User-Agent goes in its own
+            # column of the same row), then feed the table in a tight loop
+            rows = [
+                (
+                    _short_user_id(user["user_id"]),
                     user["username"],
                     user["status"],
-                    last_active_str,
-                    user.get("source") or "unknown"
+                    _format_timestamp(user.get("last_active_at")),
+                    user.get("source") or "unknown",
+                    user.get("user_agent") or "N/A",
                 )
-                if show_ua:
-                    ua = user.get("user_agent") or "N/A"
-                    table.add_row("", "", "", "", "", ua)
+                for user in users_data
+            ]
+            add_row = table.add_row
+            if show_ua:
+                for row in rows:
+                    add_row(*row)
+            else:
+                for row in rows:
+                    add_row(*row[:5])
             
             console.print(table)
             
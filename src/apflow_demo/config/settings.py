@@ -3,10 +3,15 @@ Demo settings configuration
 """
 
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
+from pydantic import AliasChoices, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# Set once .env has been checked for APFLOW_JWT_SECRET in this process
+_jwt_env_checked = False
+
 
 class DemoSettings(BaseSettings):
     """Demo application settings"""
@@ -18,48 +23,62 @@ class DemoSettings(BaseSettings):
         extra="ignore",
     )
     
+    # Every field is read from the environment (or .env) by pydantic under
+    # its upper-cased name unless a validation_alias lists other names
+    
     # Demo mode
-    demo_mode: bool = os.getenv("DEMO_MODE", "false").lower() in ("true", "1", "yes")
-    rate_limit_enabled: bool = os.getenv("RATE_LIMIT_ENABLED", "false").lower() in ("true", "1", "yes")
+    demo_mode: bool = False
+    rate_limit_enabled: bool = False
     
     # Rate limiting
-    rate_limit_daily_per_user: int = int(os.getenv("RATE_LIMIT_DAILY_PER_USER", "10"))
-    rate_limit_daily_per_ip: int = int(os.getenv("RATE_LIMIT_DAILY_PER_IP", "50"))
+    rate_limit_daily_per_user: int = 10
+    rate_limit_daily_per_ip: int = 50
     
     # LLM-consuming task tree limits
-    rate_limit_daily_llm_per_user: int = int(os.getenv("RATE_LIMIT_DAILY_LLM_PER_USER", "1"))  # Free users: only 1 LLM-consuming task tree
-    rate_limit_daily_per_user_premium: int = int(os.getenv("RATE_LIMIT_DAILY_PER_USER_PREMIUM", "10"))  # Premium users: 10 total (no separate LLM limit)
+    rate_limit_daily_llm_per_user: int = 1  # Free users: only 1 LLM-consuming task tree
+    rate_limit_daily_per_user_premium: int = 10  # Premium users: 10 total (no separate LLM limit)
     
     # Concurrency limits
-    max_concurrent_task_trees: int = int(os.getenv("MAX_CONCURRENT_TASK_TREES", "10"))  # System-wide
-    max_concurrent_task_trees_per_user: int = int(os.getenv("MAX_CONCURRENT_TASK_TREES_PER_USER", "1"))  # Per-user
+    max_concurrent_task_trees: int = 10  # System-wide
+    max_concurrent_task_trees_per_user: int = 1  # Per-user
+    # Seconds after which a task tree that never reported completion stops holding a concurrency slot (0 disables)
+    max_task_tree_seconds: int = 3600
+    
+    # Seconds quota/concurrency counters are served from the in-process cache (0 disables)
+    counter_cache_ttl: float = 60.0
     
     # Redis
-    redis_url: str = os.getenv("REDIS_URL", "redis://localhost:6379")
-    redis_db: int = int(os.getenv("REDIS_DB", "0"))
+    redis_url: str = "redis://localhost:6379"
+    redis_db: int = 0
     
     # apflow configuration (passed through)
-    apflow_api_protocol: str = os.getenv("APFLOW_API_PROTOCOL", "a2a")
-    apflow_api_host: str = os.getenv("APFLOW_API_HOST", os.getenv("API_HOST", "0.0.0.0"))
-    apflow_api_port: int = int(os.getenv("APFLOW_API_PORT", os.getenv("PORT", "8000")))
-    apflow_base_url: Optional[str] = os.getenv("APFLOW_BASE_URL")
+    apflow_api_protocol: str = "a2a"
+    apflow_api_host: str = Field("0.0.0.0", validation_alias=AliasChoices("apflow_api_host", "api_host"))
+    apflow_api_port: int = Field(8000, validation_alias=AliasChoices("apflow_api_port", "port"))
+    apflow_base_url: Optional[str] = None
     
     # JWT (optional, defaults to demo secret key if not provided)
-    apflow_jwt_secret_key: Optional[str] = os.getenv(
-        "APFLOW_JWT_SECRET",
-        "demo-secret-key-change-in-production"
+    apflow_jwt_secret_key: Optional[str] = Field(
+        "demo-secret-key-change-in-production",
+        validation_alias=AliasChoices("apflow_jwt_secret_key", "apflow_jwt_secret"),
     )
-    apflow_jwt_algorithm: str = os.getenv("APFLOW_JWT_ALGORITHM", "HS256")
+    apflow_jwt_algorithm: str = "HS256"
     
     # System routes and docs
-    apflow_enable_system_routes: bool = os.getenv("APFLOW_ENABLE_SYSTEM_ROUTES", "true").lower() in ("true", "1", "yes")
-    apflow_enable_docs: bool = os.getenv("APFLOW_ENABLE_DOCS", "true").lower() in ("true", "1", "yes")
+    apflow_enable_system_routes: bool = True
+    apflow_enable_docs: bool = True
     
     # CORS origins
-    apflow_cors_origins: Optional[str] = os.getenv("APFLOW_CORS_ORIGINS")
+    apflow_cors_origins: Optional[str] = None
     
     # Database URL
-    database_url: Optional[str] = os.getenv("APFLOW_DATABASE_URL") or os.getenv("DATABASE_URL")
+    database_url: Optional[str] = Field(None, validation_alias=AliasChoices("database_url", "apflow_database_url"))
+    
+    # PostgreSQL connection pool (many short counter transactions per request)
+    db_pool_size: int = 32
+    db_max_overflow: int = 16
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = False
 
     def model_post_init(self, __context: object) -> None:
         """Initialize settings and ensure JWT secret is written to .env"""
@@ -67,6 +86,11 @@ class DemoSettings(BaseSettings):
 
     def _ensure_jwt_secret_in_env(self) -> None:
         """Ensure APFLOW_JWT_SECRET is in .env file for apflow-demo command"""
+        global _jwt_env_checked
+        if _jwt_env_checked:
+            return
+        _jwt_env_checked = True
+
         env_file = Path(".env")
         
         # Check if APFLOW_JWT_SECRET is already set from environment
@@ -74,20 +98,21 @@ class DemoSettings(BaseSettings):
             return
         
         # Check if .env file exists and already has APFLOW_JWT_SECRET
-        if env_file.exists():
-            content = env_file.read_text()
-            if "APFLOW_JWT_SECRET" in content:
-                return
+        # (scan line by line and stop at the first hit)
+        try:
+            with env_file.open("rb") as f:
+                if any(b"APFLOW_JWT_SECRET" in line for line in f):
+                    return
+            header = "\n# JWT Secret for apflow\n"
+        except FileNotFoundError:
+            header = "# JWT Secret for apflow\n"
         
-        # Write or append APFLOW_JWT_SECRET to .env
-        if env_file.exists():
-            with open(env_file, "a", encoding="utf-8") as f:
-                f.write("\n# JWT Secret for apflow\n")
-                f.write(f"APFLOW_JWT_SECRET={self.apflow_jwt_secret_key}\n")
-        else:
-            with open(env_file, "w", encoding="utf-8") as f:
-                f.write("# JWT Secret for apflow\n")
-                f.write(f"APFLOW_JWT_SECRET={self.apflow_jwt_secret_key}\n")
+        # Write or append APFLOW_JWT_SECRET to .env in a single O_APPEND write,
+        # creating the file if needed, so concurrent workers cannot truncate it
+        entry = f"{header}APFLOW_JWT_SECRET={self.apflow_jwt_secret_key}\n"
+        fd = os.open(env_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(entry)
     
     def get_apflow_env(self) -> dict[str, str]:
         """Get environment variables for apflow"""
@@ -117,6 +142,29 @@ class DemoSettings(BaseSettings):
         return env
 
 
-# Global settings instance
-settings = DemoSettings()
+@lru_cache(maxsize=1)
+def get_settings() -> DemoSettings:
+    """Return the process-wide settings instance, created on first use"""
+    return DemoSettings()
+
+
+class _LazySettings:
+    """Stand-in for the process-wide DemoSettings that builds it on first attribute access"""
+
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name: str, value: object) -> None:
+        setattr(get_settings(), name, value)
+
+    def __delattr__(self, name: str) -> None:
+        delattr(get_settings(), name)
+
+    def __repr__(self) -> str:
+        return repr(get_settings())
+
 
+# Global settings instance. Importing it (directly or through modules that
+# import it at load time) does not parse the environment or touch .env;
+# that happens on first attribute access.
+settings = _LazySettings()
@@ -7,11 +7,13 @@ the custom TaskModel is used by both API server and CLI tools.
 """
 
 from importlib import import_module
-from apflow_demo.storage.models import CustomTaskModel
 from apflow.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Set once CustomTaskModel has been registered with the framework
+_registered = False
+
 
 def _register_custom_task_model():
     """Lazily import framework config and register CustomTaskModel.
@@ -21,12 +23,20 @@ def _register_custom_task_model():
     default `TaskModel` mapping before our custom class is registered.
     Import `set_task_model_class` lazily to ensure registration happens
     before the framework config/module creates its mappings.
+    Registration happens at most once per process.
     """
+    global _registered
+    if _registered:
+        return
+
     try:
         cfg = import_module("apflow.core.config")
         set_task_model_class = getattr(cfg, "set_task_model_class", None)
         if callable(set_task_model_class):
+            from apflow_demo.storage.models import CustomTaskModel
+
             set_task_model_class(CustomTaskModel)
+            _registered = True
             logger.info("Registered custom TaskModel with token_usage and instance_id fields")
         else:
             logger.warning("set_task_model_class not found in framework config")
@@ -11,6 +11,32 @@ from apflow_demo.utils.task_detection import is_llm_consuming_task_schema
 
 logger = get_logger(__name__)
 
+# Whether an executor class consumes LLM quota. Tasks are dispatched to an
+# executor class by their schemas, so every task an executor class runs
+# classifies the same way.
+_EXECUTOR_LLM_CACHE: Dict[type, bool] = {}
+_MISS = object()
+
+
+def _is_llm_executor(executor: Any, schemas: Any) -> bool:
+    executor_cls = type(executor)
+    is_llm = _EXECUTOR_LLM_CACHE.get(executor_cls, _MISS)
+    if is_llm is _MISS:
+        is_llm = _EXECUTOR_LLM_CACHE[executor_cls] = is_llm_consuming_task_schema(schemas)
+    return is_llm
+
+
+def _has_llm_key(task: Any, inputs: Dict[str, Any]) -> bool:
+    """Whether the user supplied their own LLM key for this task"""
+    # Priority: inputs > task.metadata > task.params, stopping at the first hit
+    if inputs.get("llm_api_key") or inputs.get("api_key"):
+        return True
+    metadata = getattr(task, "metadata", None)
+    if metadata and metadata.get("has_llm_key", False):
+        return True
+    params = getattr(task, "params", None)
+    return bool(params and (params.get("llm_api_key") or params.get("api_key")))
+
 
 async def quota_check_pre_hook(executor: Any, task: Any, inputs: Dict[str, Any]) -> None:
     """
@@ -37,28 +63,23 @@ async def quota_check_pre_hook(executor: Any, task: Any, inputs: Dict[str, Any])
     
     try:
         # Check if LLM-consuming executor
-        if not is_llm_consuming_task_schema(task.schemas):
+        if not _is_llm_executor(executor, task.schemas):
             return None  # Non-LLM executor, continue execution
         
+        if _has_llm_key(task, inputs):
+            return None  # User pays for their own LLM calls, no LLM quota to enforce
+        
         # Get user_id from task
         user_id = task.user_id or "anonymous"
         
-        # Check if user has LLM key
-        # Priority: inputs (just set above) > task.metadata > task.params
-        has_llm_key = bool(
-            inputs.get("llm_api_key") or inputs.get("api_key") or
-            (hasattr(task, 'metadata') and task.metadata and task.metadata.get("has_llm_key", False)) or
-            (hasattr(task, 'params') and task.params and (task.params.get("llm_api_key") or task.params.get("api_key")))
-        )
-        
         # Check quota status
-        quota_status = RateLimiter.get_user_quota_status(
+        quota_status = await RateLimiter.get_user_quota_status(
             user_id=user_id,
-            has_llm_key=has_llm_key,
+            has_llm_key=False,
         )
         
-        # If LLM quota exceeded and no LLM key, use built-in demo mode
-        if quota_status.get('llm_quota_exceeded') and not has_llm_key:
+        # If LLM quota exceeded (and no LLM key), use built-in demo mode
+        if quota_status.get('llm_quota_exceeded'):
             logger.info(
                 f"LLM quota exceeded for task {task.id} (user: {user_id}), "
                 f"using built-in demo mode"
@@ -13,6 +13,9 @@ from apflow.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Statuses that end a task tree; any of them frees its concurrency slot
+_TERMINAL_STATUSES = frozenset({"completed", "failed", "cancelled"})
+
 
 async def quota_tracking_on_tree_completed(root_task: TaskModel, status: str) -> None:
     """
@@ -21,6 +24,11 @@ async def quota_tracking_on_tree_completed(root_task: TaskModel, status: str) ->
     This hook is called when a task tree completes (explicit lifecycle event).
     No need to manually check if task is root - hook is only called for root tasks.
     
+    Trees that end in any terminal status release their concurrency slot.
+    A tree that is generated but never executed never reaches this hook; its
+    slot is reclaimed as stale after MAX_TASK_TREE_SECONDS, the next time a
+    concurrency check would otherwise deny a request.
+    
     Args:
         root_task: Root task of the completed task tree
         status: Task tree completion status (e.g., "completed", "failed")
@@ -29,15 +37,15 @@ async def quota_tracking_on_tree_completed(root_task: TaskModel, status: str) ->
         return
     
     try:
-        # Only track completed task trees
-        if status != "completed":
+        # Only finished task trees release their slot
+        if status not in _TERMINAL_STATUSES:
             return
         
         # Get user_id
         user_id = root_task.user_id or "anonymous"
         
         # Complete task tree tracking
-        RateLimiter.complete_task_tree(
+        await RateLimiter.complete_task_tree(
             user_id=user_id,
             task_tree_id=root_task.id,
         )
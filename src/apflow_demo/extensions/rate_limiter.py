@@ -4,17 +4,64 @@ Database-based rate limiter extension
 Uses the same database as apflow (DuckDB/PostgreSQL) instead of Redis.
 """
 
-from datetime import datetime, timezone
-from typing import Optional
-from apflow.core.storage import create_pooled_session
-from apflow_demo.storage.quota_repository import QuotaRepository
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from apflow_demo.storage.models import QuotaCounter, ConcurrencyCounter
+from apflow_demo.storage.quota_repository import QuotaRepository, today_iso
+from apflow_demo.storage.counter_cache import counter_cache
+from apflow_demo.storage.counter_flusher import counter_flusher
+from apflow_demo.storage.session_scope import pooled_session
 from apflow_demo.config.settings import settings
 
 
 class RateLimiter:
     """Rate limiter using database storage (same as apflow)"""
     
-    # _get_repository is removed as we use create_pooled_session directly
+    # _get_repository is removed as we use pooled_session directly
+    
+    @classmethod
+    async def _get_counts(cls, model: type, keys: List[tuple]) -> List[int]:
+        """
+        Read counters of one model through the in-process cache
+        
+        Args:
+            model: QuotaCounter or ConcurrencyCounter
+            keys: Primary key tuples in the model's column order
+            
+        Returns:
+            Counter values in the same order as keys
+        """
+        return await cls._get_counter_values([(model, key) for key in keys])
+    
+    @classmethod
+    async def _get_counter_values(cls, entries: List[Tuple[type, tuple]]) -> List[int]:
+        """
+        Read counters through the in-process cache
+        
+        A single database session is opened only when at least one entry misses.
+        
+        Args:
+            entries: (QuotaCounter or ConcurrencyCounter, primary key tuple) pairs
+            
+        Returns:
+            Counter values in the same order as entries
+        """
+        counts = [counter_cache.get(model, key) for model, key in entries]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            # Write queued increments first so misses are not cached stale.
+            # This waits on the request path for every queued batch to be
+            # written (and for retries of failed writes), so a miss costs a
+            # full flush plus the reads below; hits cost nothing.
+            await counter_flusher.flush()
+            async with pooled_session() as session:
+                repo = QuotaRepository(session)
+                for i in missing:
+                    model, key = entries[i]
+                    getter = repo.get_quota_count if model is QuotaCounter else repo.get_concurrency_count
+                    counts[i] = await getter(*key)
+                    counter_cache.set(model, key, counts[i])
+        return counts
     
     @classmethod
     async def check_limit(
@@ -43,43 +90,40 @@ class RateLimiter:
             return True, {"allowed": True, "reason": "rate_limiting_disabled"}
         
         try:
-            async with create_pooled_session() as session:
-                repo = QuotaRepository(session)
-                
-                limit_per_user = limit_per_user or settings.rate_limit_daily_per_user
-                limit_per_ip = limit_per_ip or settings.rate_limit_daily_per_ip
-                
-                today = datetime.now(timezone.utc).date().isoformat()
-                
-                result = {
-                    "allowed": True,
-                    "user_count": 0,
-                    "user_limit": limit_per_user,
-                    "ip_count": 0,
-                    "ip_limit": limit_per_ip,
-                }
-                
-                # Check user limit
-                if user_id:
-                    user_count = await repo.get_quota_count(user_id, today, "total")
-                    result["user_count"] = user_count
-                    
-                    if user_count >= limit_per_user:
-                        result["allowed"] = False
-                        result["reason"] = "user_limit_exceeded"
-                        return False, result
+            limit_per_user = limit_per_user or settings.rate_limit_daily_per_user
+            limit_per_ip = limit_per_ip or settings.rate_limit_daily_per_ip
+            
+            today = today_iso()
+            
+            result = {
+                "allowed": True,
+                "user_count": 0,
+                "user_limit": limit_per_user,
+                "ip_count": 0,
+                "ip_limit": limit_per_ip,
+            }
+            
+            # Check user limit
+            if user_id:
+                user_count = (await cls._get_counts(QuotaCounter, [(user_id, today, "total")]))[0]
+                result["user_count"] = user_count
                 
-                # Check IP limit (using IP as user_id for tracking)
-                if ip_address:
-                    ip_count = await repo.get_quota_count(f"ip:{ip_address}", today, "total")
-                    result["ip_count"] = ip_count
-                    
-                    if ip_count >= limit_per_ip:
-                        result["allowed"] = False
-                        result["reason"] = "ip_limit_exceeded"
-                        return False, result
+                if user_count >= limit_per_user:
+                    result["allowed"] = False
+                    result["reason"] = "user_limit_exceeded"
+                    return False, result
+            
+            # Check IP limit (using IP as user_id for tracking)
+            if ip_address:
+                ip_count = (await cls._get_counts(QuotaCounter, [(f"ip:{ip_address}", today, "total")]))[0]
+                result["ip_count"] = ip_count
                 
-                return True, result
+                if ip_count >= limit_per_ip:
+                    result["allowed"] = False
+                    result["reason"] = "ip_limit_exceeded"
+                    return False, result
+            
+            return True, result
         except Exception as e:
             print(f"Warning: Failed to check limit: {e}")
             return True, {"allowed": True, "reason": "database_error"}
@@ -104,16 +148,14 @@ class RateLimiter:
             return
         
         try:
-            async with create_pooled_session() as session:
-                repo = QuotaRepository(session)
-                
-                today = datetime.now(timezone.utc).date().isoformat()
-                
-                if user_id:
-                    await repo.increment_quota_count(user_id, today, "total", 1)
-                
-                if ip_address:
-                    await repo.increment_quota_count(f"ip:{ip_address}", today, "total", 1)
+            today = today_iso()
+            
+            # Counters are written behind in batches by the flusher
+            if user_id:
+                await counter_flusher.enqueue_quota(user_id, today, "total", 1)
+            
+            if ip_address:
+                await counter_flusher.enqueue_quota(f"ip:{ip_address}", today, "total", 1)
         except Exception as e:
             print(f"Warning: Failed to record request: {e}")
     
@@ -142,53 +184,60 @@ class RateLimiter:
             return True, {"allowed": True, "reason": "rate_limiting_disabled"}
         
         try:
-            async with create_pooled_session() as session:
-                repo = QuotaRepository(session)
-                
-                today = datetime.now(timezone.utc).date().isoformat()
-                
-                # Get current counts
-                total_count = await repo.get_quota_count(user_id, today, "total")
-                llm_count = await repo.get_quota_count(user_id, today, "llm")
-                
-                # Determine limits based on user type
-                if has_llm_key:
-                    # Premium user: 10 total, no separate LLM limit
-                    total_limit = settings.rate_limit_daily_per_user_premium
-                    llm_limit = total_limit  # No separate limit for premium users
-                else:
-                    # Free user: 10 total, only 1 LLM-consuming
-                    total_limit = settings.rate_limit_daily_per_user
-                    llm_limit = settings.rate_limit_daily_llm_per_user
-                
-                result = {
-                    "allowed": True,
-                    "total_count": total_count,
-                    "total_limit": total_limit,
-                    "llm_count": llm_count,
-                    "llm_limit": llm_limit,
-                    "is_premium": has_llm_key,
-                }
-                
-                # Check total quota
-                if total_count >= total_limit:
-                    result["allowed"] = False
-                    result["reason"] = "total_quota_exceeded"
-                    return False, result
-                
-                # Check LLM-consuming quota (only for free users)
-                if not has_llm_key and is_llm_consuming:
-                    if llm_count >= llm_limit:
-                        result["allowed"] = False
-                        result["reason"] = "llm_quota_exceeded"
-                        result["llm_quota_exceeded"] = True
-                        return False, result
-                
-                return True, result
+            today = today_iso()
+            
+            # Get current counts
+            total_count, llm_count = await cls._get_counts(
+                QuotaCounter, [(user_id, today, "total"), (user_id, today, "llm")]
+            )
+            return cls._evaluate_task_tree_quota(total_count, llm_count, is_llm_consuming, has_llm_key)
         except Exception as e:
             print(f"Warning: Failed to check task tree quota: {e}")
             return True, {"allowed": True, "reason": "database_error"}
     
+    @staticmethod
+    def _evaluate_task_tree_quota(
+        total_count: int,
+        llm_count: int,
+        is_llm_consuming: bool,
+        has_llm_key: bool,
+    ) -> tuple[bool, dict]:
+        """Apply the daily task tree limits to current quota counts"""
+        # Determine limits based on user type
+        if has_llm_key:
+            # Premium user: 10 total, no separate LLM limit
+            total_limit = settings.rate_limit_daily_per_user_premium
+            llm_limit = total_limit  # No separate limit for premium users
+        else:
+            # Free user: 10 total, only 1 LLM-consuming
+            total_limit = settings.rate_limit_daily_per_user
+            llm_limit = settings.rate_limit_daily_llm_per_user
+        
+        result = {
+            "allowed": True,
+            "total_count": total_count,
+            "total_limit": total_limit,
+            "llm_count": llm_count,
+            "llm_limit": llm_limit,
+            "is_premium": has_llm_key,
+        }
+        
+        # Check total quota
+        if total_count >= total_limit:
+            result["allowed"] = False
+            result["reason"] = "total_quota_exceeded"
+            return False, result
+        
+        # Check LLM-consuming quota (only for free users)
+        if not has_llm_key and is_llm_consuming:
+            if llm_count >= llm_limit:
+                result["allowed"] = False
+                result["reason"] = "llm_quota_exceeded"
+                result["llm_quota_exceeded"] = True
+                return False, result
+        
+        return True, result
+    
     @classmethod
     async def check_concurrency_limit(
         cls,
@@ -210,42 +259,128 @@ class RateLimiter:
             return True, {"allowed": True, "reason": "rate_limiting_disabled"}
         
         try:
-            async with create_pooled_session() as session:
-                repo = QuotaRepository(session)
-                
-                # Check global concurrency
-                global_current = await repo.get_concurrency_count("system", "global")
-                global_limit = settings.max_concurrent_task_trees
-                
-                # Check user concurrency
-                user_current = await repo.get_concurrency_count("user", user_id)
-                user_limit = settings.max_concurrent_task_trees_per_user
-                
-                result = {
-                    "allowed": True,
-                    "global_current": global_current,
-                    "global_limit": global_limit,
-                    "user_current": user_current,
-                    "user_limit": user_limit,
-                }
-                
-                # Check global limit
-                if global_current >= global_limit:
-                    result["allowed"] = False
-                    result["reason"] = "system_concurrency_limit_exceeded"
-                    return False, result
-                
-                # Check user limit
-                if user_current >= user_limit:
-                    result["allowed"] = False
-                    result["reason"] = "user_concurrency_limit_exceeded"
-                    return False, result
-                
-                return True, result
+            # Current global and user concurrency
+            global_current, user_current = await cls._get_counts(
+                ConcurrencyCounter, [("system", "global"), ("user", user_id)]
+            )
+            return await cls._evaluate_concurrency_or_release(user_id, global_current, user_current)
         except Exception as e:
             print(f"Warning: Failed to check concurrency limit: {e}")
             return True, {"allowed": True, "reason": "database_error"}
     
+    @staticmethod
+    def _evaluate_concurrency(global_current: int, user_current: int) -> tuple[bool, dict]:
+        """Apply the concurrency limits to current concurrency counts"""
+        global_limit = settings.max_concurrent_task_trees
+        user_limit = settings.max_concurrent_task_trees_per_user
+        
+        result = {
+            "allowed": True,
+            "global_current": global_current,
+            "global_limit": global_limit,
+            "user_current": user_current,
+            "user_limit": user_limit,
+        }
+        
+        # Check global limit
+        if global_current >= global_limit:
+            result["allowed"] = False
+            result["reason"] = "system_concurrency_limit_exceeded"
+            return False, result
+        
+        # Check user limit
+        if user_current >= user_limit:
+            result["allowed"] = False
+            result["reason"] = "user_concurrency_limit_exceeded"
+            return False, result
+        
+        return True, result
+    
+    @classmethod
+    async def _evaluate_concurrency_or_release(
+        cls,
+        user_id: str,
+        global_current: int,
+        user_current: int,
+    ) -> tuple[bool, dict]:
+        """
+        Apply the concurrency limits, releasing stale slots before denying
+        
+        Slots held by task trees that never reported completion are freed on
+        the denial path, so leaked counters heal without a separate reaper.
+        """
+        allowed, result = cls._evaluate_concurrency(global_current, user_current)
+        if allowed or not await cls._release_stale_task_trees():
+            return allowed, result
+        
+        global_current, user_current = await cls._get_counts(
+            ConcurrencyCounter, [("system", "global"), ("user", user_id)]
+        )
+        return cls._evaluate_concurrency(global_current, user_current)
+    
+    @classmethod
+    async def _release_stale_task_trees(cls) -> bool:
+        """
+        Release task trees running longer than max_task_tree_seconds
+        
+        Returns:
+            True if any concurrency slot was freed
+        """
+        if settings.max_task_tree_seconds <= 0:
+            return False
+        
+        started_before = datetime.now(timezone.utc) - timedelta(seconds=settings.max_task_tree_seconds)
+        async with pooled_session() as session:
+            counts = await QuotaRepository(session).release_stale_task_trees(started_before)
+        
+        # Refresh cached counters with the committed values
+        for key, count in counts.items():
+            counter_cache.set(ConcurrencyCounter, key, count)
+        return bool(counts)
+    
+    @classmethod
+    async def check_task_tree_limits(
+        cls,
+        user_id: str,
+        is_llm_consuming: bool,
+        has_llm_key: bool = False,
+    ) -> Tuple[tuple[bool, dict], tuple[bool, dict]]:
+        """
+        Check the task tree quota and the concurrency limit together
+        
+        Equivalent to check_task_tree_quota plus check_concurrency_limit, but
+        all four counters are read in one pass (at most one database session).
+        
+        Args:
+            user_id: User ID
+            is_llm_consuming: Whether the task tree is LLM-consuming
+            has_llm_key: Whether user has LLM key in header (premium user)
+            
+        Returns:
+            Tuple of ((quota_allowed, quota_info), (concurrency_allowed, concurrency_info))
+        """
+        if not settings.rate_limit_enabled:
+            disabled = {"allowed": True, "reason": "rate_limiting_disabled"}
+            return (True, disabled), (True, dict(disabled))
+        
+        try:
+            today = today_iso()
+            
+            total_count, llm_count, global_current, user_current = await cls._get_counter_values([
+                (QuotaCounter, (user_id, today, "total")),
+                (QuotaCounter, (user_id, today, "llm")),
+                (ConcurrencyCounter, ("system", "global")),
+                (ConcurrencyCounter, ("user", user_id)),
+            ])
+            return (
+                cls._evaluate_task_tree_quota(total_count, llm_count, is_llm_consuming, has_llm_key),
+                await cls._evaluate_concurrency_or_release(user_id, global_current, user_current),
+            )
+        except Exception as e:
+            print(f"Warning: Failed to check task tree limits: {e}")
+            failed = {"allowed": True, "reason": "database_error"}
+            return (True, failed), (True, dict(failed))
+    
     @classmethod
     async def start_task_tree(
         cls,
@@ -271,22 +406,25 @@ class RateLimiter:
             return False
         
         try:
-            async with create_pooled_session() as session:
+            async with pooled_session() as session:
                 repo = QuotaRepository(session)
                 
-                today = datetime.now(timezone.utc).date().isoformat()
+                today = today_iso()
                 
-                # Increment quota counters
-                await repo.increment_quota_count(user_id, today, "total", 1)
-                if is_llm_consuming:
-                    await repo.increment_quota_count(user_id, today, "llm", 1)
-                
-                # Increment concurrency counters
-                await repo.increment_concurrency("system", "global", 1)
-                await repo.increment_concurrency("user", user_id, 1)
+                # Tracking row plus quota and concurrency increments, one commit
+                counts = await repo.record_task_tree_start(
+                    task_tree_id, user_id, today, is_llm_consuming
+                )
                 
-                # Start task tree tracking
-                await repo.start_task_tree(task_tree_id, user_id, is_llm_consuming)
+                # Quota counters may still have request increments queued in
+                # the flusher, so bump cached quota values rather than
+                # overwriting them; concurrency counters are only written
+                # here, so their committed values are cached as-is
+                counter_cache.add(QuotaCounter, (user_id, today, "total"), 1)
+                if is_llm_consuming:
+                    counter_cache.add(QuotaCounter, (user_id, today, "llm"), 1)
+                counter_cache.set(ConcurrencyCounter, ("system", "global"), counts["system"])
+                counter_cache.set(ConcurrencyCounter, ("user", user_id), counts["user"])
                 
                 return True
         except Exception as e:
@@ -313,16 +451,15 @@ class RateLimiter:
             return
         
         try:
-            async with create_pooled_session() as session:
-                repo = QuotaRepository(session)
-                
-                # Get task tree tracking to check if it was LLM-consuming
-                tracking = await repo.complete_task_tree(task_tree_id)
-                
-                if tracking:
-                    # Decrement concurrency counters
-                    await repo.decrement_concurrency("system", "global", 1)
-                    await repo.decrement_concurrency("user", user_id, 1)
+            async with pooled_session() as session:
+                # Mark the tree completed and release both concurrency slots
+                # with a single commit
+                counts = await QuotaRepository(session).record_task_tree_completion(task_tree_id, user_id)
+            
+            if counts:
+                # Refresh the cache from the post-decrement counts
+                counter_cache.set(ConcurrencyCounter, ("system", "global"), counts["system"])
+                counter_cache.set(ConcurrencyCounter, ("user", user_id), counts["user"])
         except Exception as e:
             print(f"Warning: Failed to complete task tree tracking: {e}")
     
@@ -361,37 +498,35 @@ class RateLimiter:
             }
         
         try:
-            async with create_pooled_session() as session:
-                repo = QuotaRepository(session)
-                
-                today = datetime.now(timezone.utc).date().isoformat()
-                
-                total_used = await repo.get_quota_count(user_id, today, "total")
-                llm_used = await repo.get_quota_count(user_id, today, "llm")
-                
-                if has_llm_key:
-                    total_limit = settings.rate_limit_daily_per_user_premium
-                    llm_limit = total_limit
-                else:
-                    total_limit = settings.rate_limit_daily_per_user
-                    llm_limit = settings.rate_limit_daily_llm_per_user
-                
-                # Check if quotas are exceeded
-                total_quota_exceeded = total_used >= total_limit
-                llm_quota_exceeded = not has_llm_key and llm_used >= llm_limit
-                
-                return {
-                    "rate_limiting_enabled": True,
-                    "total_used": total_used,
-                    "total_limit": total_limit,
-                    "total_remaining": max(0, total_limit - total_used),
-                    "total_quota_exceeded": total_quota_exceeded,
-                    "llm_used": llm_used,
-                    "llm_limit": llm_limit,
-                    "llm_remaining": max(0, llm_limit - llm_used),
-                    "llm_quota_exceeded": llm_quota_exceeded,
-                    "is_premium": has_llm_key,
-                }
+            today = today_iso()
+            
+            total_used, llm_used = await cls._get_counts(
+                QuotaCounter, [(user_id, today, "total"), (user_id, today, "llm")]
+            )
+            
+            if has_llm_key:
+                total_limit = settings.rate_limit_daily_per_user_premium
+                llm_limit = total_limit
+            else:
+                total_limit = settings.rate_limit_daily_per_user
+                llm_limit = settings.rate_limit_daily_llm_per_user
+            
+            # Check if quotas are exceeded
+            total_quota_exceeded = total_used >= total_limit
+            llm_quota_exceeded = not has_llm_key and llm_used >= llm_limit
+            
+            return {
+                "rate_limiting_enabled": True,
+                "total_used": total_used,
+                "total_limit": total_limit,
+                "total_remaining": max(0, total_limit - total_used),
+                "total_quota_exceeded": total_quota_exceeded,
+                "llm_used": llm_used,
+                "llm_limit": llm_limit,
+                "llm_remaining": max(0, llm_limit - llm_used),
+                "llm_quota_exceeded": llm_quota_exceeded,
+                "is_premium": has_llm_key,
+            }
         except Exception as e:
             print(f"Warning: Failed to get user quota status: {e}")
             return {
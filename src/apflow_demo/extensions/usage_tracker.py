@@ -4,31 +4,23 @@ Database-based usage tracker extension
 Uses the same database as apflow (DuckDB/PostgreSQL) instead of Redis.
 """
 
-from datetime import datetime, timezone
 from typing import Optional, Dict, Any
-from apflow.core.storage import get_default_session
-from apflow_demo.storage.quota_repository import QuotaRepository
+from apflow_demo.storage.models import UsageStats
+from apflow_demo.storage.quota_repository import QuotaRepository, today_iso
+from apflow_demo.storage.session_scope import pooled_session
 from apflow_demo.config.settings import settings
 
 
 class UsageTracker:
-    """Usage tracker using database storage (same as apflow)"""
+    """
+    Usage tracker using database storage (same as apflow)
     
-    @classmethod
-    def _get_repository(cls) -> Optional[QuotaRepository]:
-        """Get quota repository instance"""
-        if not settings.rate_limit_enabled:
-            return None
-        
-        try:
-            session = get_default_session()
-            return QuotaRepository(session)
-        except Exception as e:
-            print(f"Warning: Failed to get database session: {e}. Usage tracking disabled.")
-            return None
+    Sessions come from apflow's connection pool via pooled_session(), so
+    calls made while a request holds a SessionScope reuse its session.
+    """
     
     @classmethod
-    def log_task_execution(
+    async def log_task_execution(
         cls,
         task_id: str,
         user_id: Optional[str] = None,
@@ -39,6 +31,9 @@ class UsageTracker:
         """
         Log task execution
         
+        All usage counters for the task are written with one multi-row
+        upsert and a single commit.
+        
         Args:
             task_id: Task ID
             user_id: Optional user ID
@@ -49,28 +44,23 @@ class UsageTracker:
         if not settings.rate_limit_enabled:
             return
         
-        repo = cls._get_repository()
-        if not repo:
-            return
-        
         try:
-            today = datetime.now(timezone.utc).date().isoformat()
+            today = today_iso()
             
-            # Increment total task count
-            repo.increment_usage_stat(today, "total", "global", 1)
-            
-            # Increment demo task count if demo
+            # Total task count, plus demo and user-specific counts when applicable
+            deltas = {(today, "total", "global"): 1}
             if is_demo:
-                repo.increment_usage_stat(today, "demo", "global", 1)
-            
-            # Increment user-specific count
+                deltas[(today, "demo", "global")] = 1
             if user_id:
-                repo.increment_usage_stat(today, "user", user_id, 1)
+                deltas[(today, "user", user_id)] = 1
+            
+            async with pooled_session() as session:
+                await QuotaRepository(session).apply_counter_deltas({UsageStats: deltas})
         except Exception as e:
             print(f"Warning: Failed to log task execution: {e}")
     
     @classmethod
-    def get_usage_stats(
+    async def get_usage_stats(
         cls,
         date: Optional[str] = None,
         user_id: Optional[str] = None,
@@ -87,27 +77,30 @@ class UsageTracker:
         """
         if not settings.rate_limit_enabled:
             return {
-                "date": date or datetime.now(timezone.utc).date().isoformat(),
+                "date": date or today_iso(),
                 "total_tasks": 0,
                 "demo_tasks": 0,
                 "user_tasks": 0,
             }
         
-        repo = cls._get_repository()
-        if not repo:
+        target_date = date or today_iso()
+        
+        try:
+            async with pooled_session() as session:
+                repo = QuotaRepository(session)
+                total_tasks = await repo.get_usage_stat(target_date, "total", "global")
+                demo_tasks = await repo.get_usage_stat(target_date, "demo", "global")
+                user_tasks = await repo.get_usage_stat(target_date, "user", user_id) if user_id else None
+        except Exception as e:
+            print(f"Warning: Failed to get database session: {e}. Usage tracking disabled.")
             return {
-                "date": date or datetime.now(timezone.utc).date().isoformat(),
+                "date": target_date,
                 "database_unavailable": True,
                 "total_tasks": 0,
                 "demo_tasks": 0,
                 "user_tasks": 0,
             }
         
-        target_date = date or datetime.now(timezone.utc).date().isoformat()
-        
-        total_tasks = repo.get_usage_stat(target_date, "total", "global")
-        demo_tasks = repo.get_usage_stat(target_date, "demo", "global")
-        
         result = {
             "date": target_date,
             "total_tasks": total_tasks,
@@ -115,7 +108,6 @@ class UsageTracker:
         }
         
         if user_id:
-            user_tasks = repo.get_usage_stat(target_date, "user", user_id)
             result["user_tasks"] = user_tasks
         
         return result
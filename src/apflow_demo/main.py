@@ -10,6 +10,7 @@ Follows the structure pattern from apflow/api/main.py for consistency.
 import os
 import sys
 import warnings
+import orjson
 import uvicorn
 import time
 from pathlib import Path
@@ -43,6 +44,43 @@ def _load_environment_variables():
         logger.debug(f"Loaded environment variables from {env_file}")
 
 
+def _initialize_session_pool():
+    """
+    Initialize apflow's session pool with settings tuned for the counter workload
+    
+    Must run before the first create_pooled_session() call, which otherwise
+    initializes the pool with apflow's defaults (pre-ping on every checkout).
+    Only applies to PostgreSQL; DuckDB uses a single embedded connection.
+    Connections dropped by the server are still invalidated by SQLAlchemy's
+    disconnect handling, so the first failing checkout reconnects.
+    """
+    # Same lookup order apflow uses for pooled sessions
+    database_url = os.getenv("DATABASE_URL") or os.getenv("APFLOW_DATABASE_URL")
+    if not database_url or not database_url.startswith("postgres"):
+        return
+    
+    try:
+        from apflow.core.storage import get_session_pool_manager
+        
+        get_session_pool_manager().initialize(
+            connection_string=database_url,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=settings.db_pool_pre_ping,
+            pool_use_lifo=True,
+            # Faster (de)serialization for JSON/JSONB columns
+            json_serializer=lambda value: orjson.dumps(value).decode(),
+            json_deserializer=orjson.loads,
+        )
+        logger.info(
+            f"Initialized session pool: pool_size={settings.db_pool_size}, "
+            f"max_overflow={settings.db_max_overflow}, pre_ping={settings.db_pool_pre_ping}"
+        )
+    except Exception as e:
+        logger.warning(f"Failed to initialize session pool, using apflow defaults: {e}")
+
+
 def _initialize_database_tables():
     """Initialize database tables for quota tracking if rate limiting is enabled"""
     
@@ -124,6 +162,9 @@ def start_server() -> None:
     # Load environment variables
     _load_environment_variables()
     
+    # Size the session pool before any pooled session is created
+    _initialize_session_pool()
+    
     # Initialize database tables for quota tracking (before creating app)
     _initialize_database_tables()
     
@@ -155,7 +196,7 @@ def start_server() -> None:
         host=host,
         port=port,
         workers=1,  # Single worker for async app
-        loop="asyncio",  # Use asyncio event loop
+        loop="auto",  # uvloop when installed, asyncio otherwise
         limit_concurrency=100,  # Increase concurrency limit
         limit_max_requests=1000,  # Increase max requests
         access_log=True,  # Enable access logging for debugging
@@ -6,15 +6,22 @@ import logging
 import re
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any, List
-from sqlalchemy import select, func, text, inspect
+from sqlalchemy import select, update, func, text, inspect
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy_session_proxy import SqlalchemySessionProxy
 
 from apflow.core.storage import create_pooled_session
 from apflow_demo.storage.models import DemoUser, Base
 
 logger = logging.getLogger(__name__)
 
+# Common user_id prefixes stripped when building a readable username suffix
+_PREFIX_RE = re.compile(r"^(?:demo_user_|user_)")
+
+# Module-level alias so hot paths don't re-resolve timezone.utc on every call
+_UTC = timezone.utc
+
 
 class UserTrackingService:
     """Service for managing demo users and tracking their activity"""
@@ -54,9 +61,8 @@ class UserTrackingService:
         if not user_agent:
             # Fallback to simple hash-based name
             # Strip common prefixes to get a cleaner suffix
-            user_id_str = str(user_id)
-            clean_id = user_id_str.replace("demo_user_", "").replace("user_", "")
-            return f"Guest_{clean_id[:8]}"
+            suffix = _PREFIX_RE.sub("", user_id, count=1)[:8]
+            return f"Guest_{suffix}"
             
         # Common Browser patterns (Order: specialized before generic)
         browser_map = {
@@ -89,9 +95,7 @@ class UserTrackingService:
                 break
         
         # Strip common prefixes for the suffix
-        user_id_str = str(user_id)
-        clean_id = user_id_str.replace("demo_user_", "").replace("user_", "")
-        suffix = clean_id[:8]
+        suffix = _PREFIX_RE.sub("", user_id, count=1)[:8]
         
         return f"{detected_os}{detected_browser}_{suffix}"
 
@@ -102,31 +106,31 @@ class UserTrackingService:
         username_hint: Optional[str] = None,
         user_agent: Optional[str] = None,
         created_at: Optional[datetime] = None
-    ) -> DemoUser:
+    ) -> Optional[DemoUser]:
+        """
+        Create the demo user on first sight, otherwise refresh its activity
+
+        Returns:
+            The new DemoUser when one was created, None when an existing
+            user was updated in place (no ORM instance is loaded for updates)
+        """
         if not user_id:
             logger.warning("track_user_activity called with empty user_id, skipping")
             return None
 
-        # Ensure tables exist first
-        try:
-            await self.ensure_tables_exist()
-        except Exception as e:
-            logger.error(f"Failed to ensure tables exist: {e}")
-
         async with create_pooled_session() as session:
             try:
-                # Check if user exists
-                stmt = select(DemoUser).where(DemoUser.user_id == user_id)
+                # Check if user exists (primary key probe, no ORM hydration)
+                stmt = select(DemoUser.user_id).where(DemoUser.user_id == user_id).limit(1)
                 if isinstance(session, AsyncSession):
                     result = await session.execute(stmt)
-                    user = result.scalar_one_or_none()
                 else:
                     result = session.execute(stmt)
-                    user = result.scalar_one_or_none()
+                user_exists = result.scalar_one_or_none() is not None
 
-                now = datetime.now(timezone.utc)
+                now = datetime.now(_UTC)
 
-                if not user:
+                if not user_exists:
                     # Create new user
                     username = username_hint or await self._generate_username_from_ua(user_id, user_agent)
                     
@@ -149,23 +153,27 @@ class UserTrackingService:
                         await session.commit()
                     else:
                         session.commit()
+                    return user
+
+                # Update activity status with a direct UPDATE
+                values: Dict[str, Any] = {"last_active_at": now}
+                if source:
+                    values["source"] = source
+                if user_agent:
+                    user_agent_short = user_agent[:50] + "..." if len(user_agent) > 50 else user_agent
+                    values["user_agent"] = user_agent
+                    logger.debug(f"Updated user agent for {user_id}: {user_agent_short}")
+
+                update_stmt = update(DemoUser).where(DemoUser.user_id == user_id).values(**values)
+                if isinstance(session, AsyncSession):
+                    await session.execute(update_stmt)
+                    await session.commit()
                 else:
-                    # Update activity status
-                    user.last_active_at = now
-                    if source:
-                        user.source = source
-                    if user_agent:
-                        user_agent_short = user_agent[:50] + "..." if len(user_agent) > 50 else user_agent
-                        user.user_agent = user_agent
-                        logger.debug(f"Updated user agent for {user_id}: {user_agent_short}")
-                    
-                    logger.debug(f"Updated activity for user: {user_id}")
-                    if isinstance(session, AsyncSession):
-                        await session.commit()
-                    else:
-                        session.commit()
-                
-                return user
+                    session.execute(update_stmt)
+                    session.commit()
+
+                logger.debug(f"Updated activity for user: {user_id}")
+                return None
             except Exception as e:
                 # Handle race conditions (IntegrityError) during concurrent new user creation
                 from sqlalchemy.exc import IntegrityError
@@ -201,53 +209,55 @@ class UserTrackingService:
                 "new_users": int
             }
         """
+        # Time filtering
+        now = datetime.now(_UTC)
+        since = None
+        
+        if period == "day":
+            since = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        elif period == "week":
+            since = now - timedelta(days=7)
+        elif period == "month":
+            since = now - timedelta(days=30)
+        elif period == "year":
+            since = now - timedelta(days=365)
+
+        # Total, new and active counts in one aggregate query
+        user_count = func.count(DemoUser.user_id)
+        columns = [user_count]
+        if since:
+            columns.append(user_count.filter(DemoUser.created_at >= since))
+            columns.append(user_count.filter(DemoUser.last_active_at >= since))
+        stmt = select(*columns)
+
         async with create_pooled_session() as session:
-            # Total users count
-            total_stmt = select(func.count(DemoUser.user_id))
-            if isinstance(session, AsyncSession):
-                total_result = await session.execute(total_stmt)
-            else:
-                total_result = session.execute(total_stmt)
-            total_users = total_result.scalar() or 0
+            result = await SqlalchemySessionProxy(session).execute(stmt)
+            counts = result.one()
 
-            # Time filtering
-            now = datetime.now(timezone.utc)
-            since = None
-            
-            if period == "day":
-                since = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            elif period == "week":
-                since = now - timedelta(days=7)
-            elif period == "month":
-                since = now - timedelta(days=30)
-            elif period == "year":
-                since = now - timedelta(days=365)
-
-            # New users in period
-            new_users = 0
-            active_users = total_users
-            
-            if since:
-                new_stmt = select(func.count(DemoUser.user_id)).where(DemoUser.created_at >= since)
-                active_stmt = select(func.count(DemoUser.user_id)).where(DemoUser.last_active_at >= since)
-                
-                if isinstance(session, AsyncSession):
-                    new_result = await session.execute(new_stmt)
-                    active_result = await session.execute(active_stmt)
-                else:
-                    new_result = session.execute(new_stmt)
-                    active_result = session.execute(active_stmt)
-                
-                new_users = new_result.scalar() or 0
-                active_users = active_result.scalar() or 0
-
-            return {
-                "total_users": total_users,
-                "active_users": active_users,
-                "new_users": new_users,
-                "period": period,
-                "timestamp": now.isoformat()
-            }
+        total_users = counts[0] or 0
+        # New users in period
+        new_users = 0
+        active_users = total_users
+        if since:
+            new_users = counts[1] or 0
+            active_users = counts[2] or 0
+
+        return {
+            "total_users": total_users,
+            "active_users": active_users,
+            "new_users": new_users,
+            "period": period,
+            "timestamp": now.isoformat()
+        }
 
 from datetime import timedelta
 user_tracking_service = UserTrackingService()
+
+
+async def init_demo_schema() -> None:
+    """
+    Create demo tables once at application startup
+
+    Keeps the DDL check off the per-request tracking path.
+    """
+    await user_tracking_service.ensure_tables_exist()
@@ -11,6 +11,9 @@ from apflow_demo.storage.models import (
     UsageStats,
 )
 from apflow_demo.storage.quota_repository import QuotaRepository
+from apflow_demo.storage.counter_cache import CounterCache
+from apflow_demo.storage.counter_flusher import CounterFlusher
+from apflow_demo.storage.session_scope import SessionScope, pooled_session
 
 __all__ = [
     "QuotaCounter",
@@ -18,5 +21,9 @@ __all__ = [
     "TaskTreeTracking",
     "UsageStats",
     "QuotaRepository",
+    "CounterCache",
+    "CounterFlusher",
+    "SessionScope",
+    "pooled_session",
 ]
 
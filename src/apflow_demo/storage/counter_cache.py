@@ -0,0 +1,82 @@
+"""
+In-process read cache for quota and concurrency counters
+
+Fronts the database for rate-limit checks. The database stays authoritative:
+misses are loaded from it, entries expire after a short TTL, and increments
+queued through the counter flusher are applied to cached values immediately.
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+from apflow_demo.config.settings import settings
+
+
+class CounterCache:
+    """TTL cache of counter values keyed on (model, primary key tuple)"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: int = 10000):
+        """
+        Args:
+            ttl: Seconds an entry is trusted before it is reloaded (0 disables
+                caching); None reads COUNTER_CACHE_TTL from the settings on first use
+            max_entries: Size at which expired entries are pruned
+        """
+        self._ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple[type, tuple], Tuple[int, float]] = {}
+
+    @property
+    def ttl(self) -> float:
+        """Seconds an entry is trusted before it is reloaded"""
+        if self._ttl is None:
+            self._ttl = settings.counter_cache_ttl
+        return self._ttl
+
+    @ttl.setter
+    def ttl(self, value: float) -> None:
+        self._ttl = value
+
+    def get(self, model: type, key: tuple) -> Optional[int]:
+        """Return the cached value, or None when missing or expired"""
+        entry = self._entries.get((model, key))
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[(model, key)]
+            return None
+        return value
+
+    def set(self, model: type, key: tuple, value: int) -> None:
+        """Cache a value read from (or returned by) the database"""
+        if self.ttl <= 0:
+            return
+        if len(self._entries) >= self.max_entries:
+            self._prune()
+        self._entries[(model, key)] = (value, time.monotonic() + self.ttl)
+
+    def add(self, model: type, key: tuple, amount: int) -> None:
+        """Apply a delta to a cached value, clamped at zero; misses are left to the next read"""
+        entry = self._entries.get((model, key))
+        if entry is not None:
+            value, expires_at = entry
+            self._entries[(model, key)] = (max(0, value + amount), expires_at)
+
+    def invalidate(self, model: type, key: tuple) -> None:
+        """Drop one cached value so the next read reloads it from the database"""
+        self._entries.pop((model, key), None)
+
+    def clear(self) -> None:
+        """Drop all cached values"""
+        self._entries.clear()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+
+
+# Process-wide cache shared by the rate limiter and the counter flusher
+counter_cache = CounterCache()
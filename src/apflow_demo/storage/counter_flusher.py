@@ -0,0 +1,145 @@
+"""
+Write-behind queue for per-request quota counters
+
+Coalesces quota increments from the request hot path and writes them in
+batches: one multi-row upsert and a single commit per flush. Task tree
+starts and completions write their counters directly in one transaction.
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from apflow.core.storage import create_pooled_session
+from apflow_demo.storage.counter_cache import counter_cache
+from apflow_demo.storage.models import QuotaCounter
+from apflow_demo.storage.quota_repository import QuotaRepository
+
+logger = logging.getLogger(__name__)
+
+# Queue entry: (counter model, primary key tuple, amount, failed write attempts)
+_Entry = Tuple[type, tuple, int, int]
+
+
+class CounterFlusher:
+    """Batches counter increments and flushes them in the background"""
+
+    def __init__(self, flush_interval: float = 0.05, max_batch: int = 256, max_retries: int = 3):
+        """
+        Args:
+            flush_interval: Seconds to keep collecting after the first queued entry
+            max_batch: Maximum entries drained per flush
+            max_retries: Times a failed increment is re-queued before it is dropped
+        """
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def enqueue_quota(self, user_id: str, date: str, counter_type: str = "total", amount: int = 1) -> None:
+        """Queue a QuotaCounter increment"""
+        await self._enqueue(QuotaCounter, (user_id, date, counter_type), amount)
+
+    async def flush(self) -> None:
+        """
+        Write every queued increment before returning
+
+        Drains pending entries directly instead of waiting for the flush
+        interval, then waits for any batch the background task is writing,
+        including retries of increments whose write failed.
+        """
+        if self._queue is None:
+            return
+
+        batch: List[_Entry] = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        await self._write(batch)
+        await self._queue.join()
+
+    async def close(self) -> None:
+        """Flush pending increments and stop the background task"""
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _enqueue(self, model: type, key: tuple, amount: int) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._ensure_running()
+        # Keep cached reads in step with increments that are not yet written
+        counter_cache.add(model, key, amount)
+        await self._queue.put((model, key, amount, 0))
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(batch)
+
+    async def _write(self, batch: List[_Entry]) -> None:
+        if not batch:
+            return
+
+        # Sum duplicate keys so each row is upserted once per flush
+        deltas: Dict[type, Dict[tuple, int]] = {}
+        attempts: Dict[Tuple[type, tuple], int] = {}
+        for model, key, amount, failed in batch:
+            counts = deltas.setdefault(model, {})
+            counts[key] = counts.get(key, 0) + amount
+            attempts[(model, key)] = max(attempts.get((model, key), 0), failed)
+
+        try:
+            async with create_pooled_session() as session:
+                await QuotaRepository(session).apply_counter_deltas(deltas)
+        except Exception as e:
+            logger.warning(f"Failed to flush {len(batch)} counter increments: {e}")
+            self._retry(deltas, attempts)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _retry(self, deltas: Dict[type, Dict[tuple, int]], attempts: Dict[Tuple[type, tuple], int]) -> None:
+        """
+        Re-queue the summed deltas of a failed write, dropping them once
+        they have failed max_retries times
+
+        Re-queued deltas are already reflected in the cache, so they are put
+        back without touching it; dropped ones invalidate their cache keys so
+        reads fall back to the database instead of running high.
+        """
+        for model, counts in deltas.items():
+            for key, amount in counts.items():
+                failed = attempts[(model, key)] + 1
+                if failed <= self.max_retries:
+                    self._queue.put_nowait((model, key, amount, failed))
+                else:
+                    logger.error(
+                        f"Dropping {model.__name__} increment {key} by {amount} "
+                        f"after {failed} failed writes"
+                    )
+                    counter_cache.invalidate(model, key)
+        self._ensure_running()
+
+
+# Process-wide flusher used by the rate limiter
+counter_flusher = CounterFlusher()
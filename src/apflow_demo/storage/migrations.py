@@ -0,0 +1,118 @@
+"""
+Schema migrations for demo tables on existing databases
+
+create_all() only creates missing tables, so index and column changes to
+existing tables are applied here at startup. Every step is idempotent.
+"""
+
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from apflow.core.storage import create_pooled_session
+from apflow_demo.storage.models import CustomTaskModel
+
+logger = logging.getLogger(__name__)
+
+# is_llm_consuming used to be VARCHAR(10) holding 'true'/'false'
+_BOOLEAN_LLM_FLAG_STATEMENTS = [
+    "ALTER TABLE demo_task_tree_tracking ALTER COLUMN is_llm_consuming "
+    "TYPE BOOLEAN USING is_llm_consuming = 'true'",
+    "ALTER TABLE demo_task_tree_tracking ALTER COLUMN is_llm_consuming SET DEFAULT false",
+]
+
+# DuckDB refuses ALTER COLUMN ... TYPE while indexes depend on the table
+_DUCKDB_TABLE_INDEXES_QUERY = (
+    "SELECT index_name, sql FROM duckdb_indexes() "
+    "WHERE schema_name = current_schema() AND table_name = :table_name AND sql IS NOT NULL"
+)
+
+# PostgreSQL: replace the (user_id, completed_at) index with a partial index
+# over active task trees. CONCURRENTLY avoids locking writes on large tables
+# and must run outside a transaction.
+_POSTGRES_INDEX_STATEMENTS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_task_tree_user_active "
+    "ON demo_task_tree_tracking (user_id) WHERE completed_at IS NULL",
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_task_tree_active",
+]
+
+# PostgreSQL: index demo_users for the admin listing (status filter, newest
+# activity first); the status-leading composite index supersedes idx_user_status
+_POSTGRES_USER_INDEX_STATEMENTS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_demo_users_status_last_active "
+    "ON demo_users (status, last_active_at DESC)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_demo_users_last_active "
+    "ON demo_users (last_active_at DESC)",
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_user_status",
+]
+
+
+def _column_type(conn: Connection, table_name: str, column_name: str):
+    return conn.execute(
+        text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_schema = current_schema() "
+            "AND table_name = :table_name AND column_name = :column_name"
+        ),
+        {"table_name": table_name, "column_name": column_name},
+    ).scalar()
+
+
+def _migrate(conn: Connection, dialect: str) -> None:
+    column_type = _column_type(conn, "demo_task_tree_tracking", "is_llm_consuming")
+    if column_type is not None and column_type.lower() != "boolean":
+        indexes = []
+        if dialect == "duckdb":
+            # Drop the table's indexes around the type change and recreate
+            # them from their original DDL afterwards
+            indexes = conn.execute(
+                text(_DUCKDB_TABLE_INDEXES_QUERY),
+                {"table_name": "demo_task_tree_tracking"},
+            ).all()
+            for index_name, _ in indexes:
+                conn.execute(text(f'DROP INDEX "{index_name}"'))
+        for statement in _BOOLEAN_LLM_FLAG_STATEMENTS:
+            conn.execute(text(statement))
+        for _, create_sql in indexes:
+            conn.execute(text(create_sql))
+        logger.info("Converted demo_task_tree_tracking.is_llm_consuming to BOOLEAN")
+
+    if dialect == "postgresql":
+        for statement in _POSTGRES_INDEX_STATEMENTS + _POSTGRES_USER_INDEX_STATEMENTS:
+            conn.execute(text(statement))
+
+        # token_usage moved from json to jsonb
+        task_table = CustomTaskModel.__table__.name
+        if _column_type(conn, task_table, "token_usage") == "json":
+            conn.execute(text(
+                f"ALTER TABLE {task_table} ALTER COLUMN token_usage "
+                "TYPE JSONB USING token_usage::jsonb"
+            ))
+            logger.info(f"Converted {task_table}.token_usage to JSONB")
+
+
+async def migrate_demo_schema() -> None:
+    """
+    Bring existing demo tables up to the current model definitions
+
+    Call after the tables have been created (see init_demo_schema).
+    """
+    async with create_pooled_session() as session:
+        engine = session.bind
+        dialect = engine.dialect.name
+        if dialect not in ("postgresql", "duckdb"):
+            return
+
+        if isinstance(session, AsyncSession):
+            # PostgreSQL (asyncpg): autocommit so CONCURRENTLY is allowed
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.run_sync(_migrate, dialect)
+        else:
+            # Sync engine (like DuckDB)
+            with engine.begin() as conn:
+                _migrate(conn, dialect)
+
+        logger.info("Applied demo schema migrations")
@@ -4,7 +4,8 @@ SQLAlchemy models for quota and rate limiting storage
 Uses the same database as apflow (DuckDB/PostgreSQL).
 """
 
-from sqlalchemy import Column, String, Integer, DateTime, JSON, Index, UniqueConstraint
+from sqlalchemy import Boolean, Column, String, Integer, DateTime, JSON, Index, UniqueConstraint, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from sqlalchemy.orm import declarative_base
 from datetime import datetime, timezone
@@ -13,6 +14,9 @@ from datetime import datetime, timezone
 from apflow.core.storage.sqlalchemy.models import Base
 from apflow.core.storage.sqlalchemy.models import TaskModel as BaseTaskModel
 
+# Binary JSONB on PostgreSQL (no re-parse on read), generic JSON elsewhere
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 
 class DemoUser(Base):
     """
@@ -35,7 +39,17 @@ class DemoUser(Base):
     user_agent = Column(String(500), nullable=True)
     
     __table_args__ = (
-        Index('idx_user_status', 'status'),
+        # Admin user listing filters on status and orders by recent activity;
+        # these let PostgreSQL read the newest rows in index order instead of
+        # sorting the table. DuckDB does not use indexes for ordering, so it
+        # keeps the plain status index.
+        Index(
+            'idx_demo_users_status_last_active', 'status', last_active_at.desc(),
+        ).ddl_if(dialect=('postgresql', 'sqlite')),
+        Index(
+            'idx_demo_users_last_active', last_active_at.desc(),
+        ).ddl_if(dialect=('postgresql', 'sqlite')),
+        Index('idx_user_status', 'status').ddl_if(dialect='duckdb'),
     )
 
 
@@ -91,13 +105,21 @@ class TaskTreeTracking(Base):
     
     task_tree_id = Column(String(255), primary_key=True, nullable=False, index=True)
     user_id = Column(String(255), nullable=False, index=True)
-    is_llm_consuming = Column(String(10), nullable=False, default='false')  # 'true' or 'false' (stored as string for compatibility)
+    is_llm_consuming = Column(Boolean, nullable=False, default=False, server_default=text('false'))
     started_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     completed_at = Column(DateTime(timezone=True), nullable=True)
     
     __table_args__ = (
         Index('idx_task_tree_user', 'user_id'),
-        Index('idx_task_tree_active', 'user_id', 'completed_at'),
+        # Partial index over the small set of active trees (completed rows
+        # dominate over time); DuckDB has no partial indexes, so it keeps
+        # the composite index instead
+        Index(
+            'idx_task_tree_user_active', 'user_id',
+            postgresql_where=text('completed_at IS NULL'),
+            sqlite_where=text('completed_at IS NULL'),
+        ).ddl_if(dialect=('postgresql', 'sqlite')),
+        Index('idx_task_tree_active', 'user_id', 'completed_at').ddl_if(dialect='duckdb'),
     )
 
 
@@ -149,7 +171,7 @@ class CustomTaskModel(BaseTaskModel):
     # Don't override __tablename__ - inherit from BaseTaskModel to use same table
     
     # Extended fields - these will be added to the existing table
-    token_usage = Column(JSON, nullable=True, comment="Token usage statistics (prompt_tokens, completion_tokens, total_tokens)")
+    token_usage = Column(JSONType, nullable=True, comment="Token usage statistics (prompt_tokens, completion_tokens, total_tokens)")
     instance_id = Column(String(255), nullable=True, index=True, comment="Distributed service instance ID")
     
     # Configure mapper to use single-table inheritance
@@ -161,13 +183,12 @@ class CustomTaskModel(BaseTaskModel):
     def to_dict(self) -> dict:
         """Extend base `to_dict` to include custom fields.
 
-        Calls the parent `to_dict` and then appends `token_usage` and
-        `instance_id` so CLI and API JSON output include these fields.
+        Merges the parent `to_dict` with `token_usage` and `instance_id`
+        so CLI and API JSON output include these fields.
         """
-        base = super().to_dict()
-        base.update({
+        return {
+            **super().to_dict(),
             "token_usage": self.token_usage,
             "instance_id": self.instance_id,
-        })
-        return base
+        }
 
@@ -4,10 +4,13 @@ Repository for quota and rate limiting data
 Uses SQLAlchemy to store quota data in the same database as apflow.
 """
 
+import time
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, Union, List
-from sqlalchemy import and_, func as sql_func, select, delete
-from sqlalchemy.orm import Session
+from typing import Optional, Dict, Any, Union, List, Tuple
+from sqlalchemy import Date, and_, case, cast, func as sql_func, literal_column, select, delete, insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, raiseload
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy_session_proxy import SqlalchemySessionProxy
 
@@ -18,12 +21,123 @@ from apflow_demo.storage.models import (
     UsageStats,
 )
 
+# Counter tables, addressed through Core so hot counter statements skip
+# ORM statement handling (no entity rows, no identity-map synchronization)
+_quota_counters = QuotaCounter.__table__
+_concurrency_counters = ConcurrencyCounter.__table__
+_usage_stats = UsageStats.__table__
+
+# Row count at which bulk task tree inserts switch to PostgreSQL COPY
+BULK_COPY_THRESHOLD = 1024
+
+# (UTC epoch day, ISO date) of the last today_iso() call
+_today_cache = (-1, "")
+
+
+def today_iso() -> str:
+    """
+    Today's UTC date as YYYY-MM-DD, formatted once per day
+    
+    Epoch days line up with UTC dates, so the cached string is refreshed
+    exactly when the date changes.
+    """
+    global _today_cache
+    day = int(time.time() // 86400)
+    if _today_cache[0] != day:
+        _today_cache = (day, datetime.fromtimestamp(day * 86400, timezone.utc).date().isoformat())
+    return _today_cache[1]
+
+
+# (UTC epoch day, ISO timestamp of the following midnight) of the last quota_reset_iso() call
+_reset_cache = (-1, "")
+
+
+def quota_reset_iso() -> str:
+    """
+    When daily quotas reset: next midnight UTC as an ISO 8601 timestamp
+    
+    Cached like today_iso(), so it is formatted once per day.
+    """
+    global _reset_cache
+    day = int(time.time() // 86400)
+    if _reset_cache[0] != day:
+        _reset_cache = (day, datetime.fromtimestamp((day + 1) * 86400, timezone.utc).isoformat())
+    return _reset_cache[1]
+
 
 class QuotaRepository:
     """Repository for quota and rate limiting data"""
     
     def __init__(self, session: Union[Session, AsyncSession]):
         self.session = SqlalchemySessionProxy(session)
+
+    def _insert(self, table):
+        """
+        Build a dialect-specific INSERT supporting ON CONFLICT DO UPDATE
+
+        PostgreSQL and DuckDB (duckdb_engine derives from the PostgreSQL
+        dialect) share the PostgreSQL construct; SQLite has its own.
+        """
+        if self.session.get_bind().dialect.name == "sqlite":
+            return sqlite_insert(table)
+        return pg_insert(table)
+
+    async def _upsert_count(
+        self,
+        table,
+        index_elements: List[str],
+        values: Dict[str, Any],
+        commit: bool = True,
+    ) -> int:
+        """
+        Atomically add values["count"] to a counter row, creating it if missing
+
+        Issues a single INSERT ... ON CONFLICT DO UPDATE ... RETURNING count
+        instead of SELECT followed by UPDATE/INSERT.
+        """
+        stmt = self._insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={
+                "count": table.c.count + stmt.excluded.count,
+                "updated_at": sql_func.now(),
+            },
+        ).returning(table.c.count)
+
+        result = await self.session.execute(stmt)
+        count = result.scalar_one()
+        if commit:
+            await self.session.commit()
+        return count
+    
+    async def apply_counter_deltas(self, deltas: Dict[Any, Dict[tuple, int]]) -> None:
+        """
+        Apply batched counter increments with one upsert per table and one commit
+
+        Args:
+            deltas: Mapping of counter model to {primary key tuple: amount},
+                with key values in the model's primary key column order
+        """
+        for model, counts in deltas.items():
+            if not counts:
+                continue
+            table = model.__table__
+            pk_names = [column.name for column in table.primary_key.columns]
+            rows = [
+                {**dict(zip(pk_names, key)), "count": amount}
+                for key, amount in counts.items()
+            ]
+            stmt = self._insert(table).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=pk_names,
+                set_={
+                    "count": table.c.count + stmt.excluded.count,
+                    "updated_at": sql_func.now(),
+                },
+            )
+            await self.session.execute(stmt)
+        
+        await self.session.commit()
     
     async def get_quota_count(
         self,
@@ -34,56 +148,31 @@ class QuotaRepository:
         """
         Get quota count for user on a specific date
         """
-        stmt = select(QuotaCounter).filter(
-            and_(
-                QuotaCounter.user_id == user_id,
-                QuotaCounter.date == date,
-                QuotaCounter.counter_type == counter_type,
-            )
+        stmt = select(_quota_counters.c.count).where(
+            _quota_counters.c.user_id == user_id,
+            _quota_counters.c.date == date,
+            _quota_counters.c.counter_type == counter_type,
         )
-        
         result = await self.session.execute(stmt)
-        
-        counter = result.scalar_one_or_none()
-        return counter.count if counter else 0
+        return result.scalar() or 0
     
     async def increment_quota_count(
         self,
         user_id: str,
         date: str,
         counter_type: str = "total",
-        amount: int = 1
+        amount: int = 1,
+        commit: bool = True,
     ) -> int:
         """
         Increment quota count for user on a specific date
         """
-        stmt = select(QuotaCounter).filter(
-            and_(
-                QuotaCounter.user_id == user_id,
-                QuotaCounter.date == date,
-                QuotaCounter.counter_type == counter_type,
-            )
+        return await self._upsert_count(
+            _quota_counters,
+            ["user_id", "date", "counter_type"],
+            {"user_id": user_id, "date": date, "counter_type": counter_type, "count": amount},
+            commit=commit,
         )
-        
-        result = await self.session.execute(stmt)
-            
-        counter = result.scalar_one_or_none()
-        
-        if counter:
-            counter.count += amount
-            counter.updated_at = datetime.now(timezone.utc)
-        else:
-            counter = QuotaCounter(
-                user_id=user_id,
-                date=date,
-                counter_type=counter_type,
-                count=amount,
-            )
-            self.session.add(counter)
-        
-        await self.session.commit()
-            
-        return counter.count
     
     async def get_concurrency_count(
         self,
@@ -93,86 +182,72 @@ class QuotaRepository:
         """
         Get concurrency count
         """
-        stmt = select(ConcurrencyCounter).filter(
-            and_(
-                ConcurrencyCounter.scope == scope,
-                ConcurrencyCounter.identifier == identifier,
-            )
+        stmt = select(_concurrency_counters.c.count).where(
+            _concurrency_counters.c.scope == scope,
+            _concurrency_counters.c.identifier == identifier,
         )
-        
         result = await self.session.execute(stmt)
-            
-        counter = result.scalar_one_or_none()
-        return counter.count if counter else 0
+        return result.scalar() or 0
     
     async def increment_concurrency(
         self,
         scope: str,
         identifier: str,
-        amount: int = 1
+        amount: int = 1,
+        commit: bool = True,
     ) -> int:
         """
         Increment concurrency count
         """
-        stmt = select(ConcurrencyCounter).filter(
-            and_(
-                ConcurrencyCounter.scope == scope,
-                ConcurrencyCounter.identifier == identifier,
-            )
+        return await self._upsert_count(
+            _concurrency_counters,
+            ["scope", "identifier"],
+            {"scope": scope, "identifier": identifier, "count": amount},
+            commit=commit,
         )
-        
-        result = await self.session.execute(stmt)
-            
-        counter = result.scalar_one_or_none()
-        
-        if counter:
-            counter.count += amount
-            counter.updated_at = datetime.now(timezone.utc)
-        else:
-            counter = ConcurrencyCounter(
-                scope=scope,
-                identifier=identifier,
-                count=amount,
-            )
-            self.session.add(counter)
-        
-        await self.session.commit()
-            
-        return counter.count
     
     async def decrement_concurrency(
         self,
         scope: str,
         identifier: str,
-        amount: int = 1
+        amount: int = 1,
+        commit: bool = True,
     ) -> int:
         """
         Decrement concurrency count
         """
-        stmt = select(ConcurrencyCounter).filter(
-            and_(
-                ConcurrencyCounter.scope == scope,
-                ConcurrencyCounter.identifier == identifier,
+        remaining = _concurrency_counters.c.count - amount
+        stmt = (
+            update(_concurrency_counters)
+            .where(
+                and_(
+                    _concurrency_counters.c.scope == scope,
+                    _concurrency_counters.c.identifier == identifier,
+                )
+            )
+            .values(
+                count=case((remaining > 0, remaining), else_=0),
+                updated_at=sql_func.now(),
             )
+            .returning(_concurrency_counters.c.count)
         )
         
         result = await self.session.execute(stmt)
-            
-        counter = result.scalar_one_or_none()
+        count = result.scalar_one_or_none()
         
-        if counter:
-            counter.count = max(0, counter.count - amount)
-            counter.updated_at = datetime.now(timezone.utc)
-            await self.session.commit()
-            return counter.count
+        if count is None:
+            return 0
         
-        return 0
+        if commit:
+            await self.session.commit()
+        return count
     
     async def start_task_tree(
         self,
         task_tree_id: str,
         user_id: str,
-        is_llm_consuming: bool
+        is_llm_consuming: bool,
+        commit: bool = True,
     ) -> None:
         """
         Start tracking a task tree
@@ -180,32 +255,183 @@ class QuotaRepository:
         tracking = TaskTreeTracking(
             task_tree_id=task_tree_id,
             user_id=user_id,
-            is_llm_consuming='true' if is_llm_consuming else 'false',
+            is_llm_consuming=is_llm_consuming,
         )
         self.session.add(tracking)
+        if commit:
+            await self.session.commit()
+    
+    async def record_task_tree_start(
+        self,
+        task_tree_id: str,
+        user_id: str,
+        date: str,
+        is_llm_consuming: bool
+    ) -> Dict[str, int]:
+        """
+        Start tracking a task tree and bump its counters in one transaction
+        
+        Inserts the tracking row, increments the daily quota counters and the
+        system/user concurrency counters, then commits once. Either all of
+        them land or none do.
+        
+        Returns:
+            Post-increment counts keyed by "total", "llm" (only when
+            LLM-consuming), "system" and "user"
+        """
+        await self.start_task_tree(task_tree_id, user_id, is_llm_consuming, commit=False)
+        
+        counts = {"total": await self.increment_quota_count(user_id, date, "total", 1, commit=False)}
+        if is_llm_consuming:
+            counts["llm"] = await self.increment_quota_count(user_id, date, "llm", 1, commit=False)
+        counts["system"] = await self.increment_concurrency("system", "global", 1, commit=False)
+        counts["user"] = await self.increment_concurrency("user", user_id, 1, commit=False)
+        
+        await self.session.commit()
+        return counts
+    
+    async def bulk_start_task_trees(
+        self,
+        rows: List[Tuple[str, str, bool]]
+    ) -> int:
+        """
+        Start tracking many task trees at once (seeding, recovery, backfill)
+        
+        Batches of BULK_COPY_THRESHOLD rows or more are written with COPY on
+        PostgreSQL (asyncpg); smaller batches and other databases use a single
+        executemany INSERT.
+        
+        Args:
+            rows: (task_tree_id, user_id, is_llm_consuming) tuples
+            
+        Returns:
+            Number of rows inserted
+        """
+        if not rows:
+            return 0
+        
+        columns = ["task_tree_id", "user_id", "is_llm_consuming"]
+        records = [
+            (task_tree_id, user_id, bool(is_llm_consuming))
+            for task_tree_id, user_id, is_llm_consuming in rows
+        ]
+        
+        dialect = self.session.get_bind().dialect
+        if (
+            len(records) >= BULK_COPY_THRESHOLD
+            and dialect.name == "postgresql"
+            and dialect.driver == "asyncpg"
+        ):
+            connection = await self.session.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                TaskTreeTracking.__tablename__,
+                records=records,
+                columns=columns,
+            )
+        else:
+            await self.session.execute(
+                insert(TaskTreeTracking),
+                [dict(zip(columns, record)) for record in records],
+            )
+        
         await self.session.commit()
+        return len(records)
     
     async def complete_task_tree(
         self,
-        task_tree_id: str
+        task_tree_id: str,
+        commit: bool = True,
     ) -> Optional[TaskTreeTracking]:
         """
         Mark task tree as completed
+        
+        Returns:
+            The tracking row, or None when it is unknown or already completed
+            (e.g. released as stale), so callers release its slot only once
         """
-        stmt = select(TaskTreeTracking).filter(
-            TaskTreeTracking.task_tree_id == task_tree_id
-        )
+        tracking = await self.session.get(TaskTreeTracking, task_tree_id)
         
-        result = await self.session.execute(stmt)
-            
-        tracking = result.scalar_one_or_none()
+        if tracking is None or tracking.completed_at is not None:
+            return None
         
-        if tracking:
-            tracking.completed_at = datetime.now(timezone.utc)
+        tracking.completed_at = datetime.now(timezone.utc)
+        if commit:
             await self.session.commit()
-        
         return tracking
     
+    async def record_task_tree_completion(
+        self,
+        task_tree_id: str,
+        user_id: str
+    ) -> Optional[Dict[str, int]]:
+        """
+        Complete a task tree and release its concurrency slots in one transaction
+        
+        Returns:
+            Post-decrement counts keyed by "system" and "user", or None when
+            the tree is unknown or already completed (nothing is released)
+        """
+        tracking = await self.complete_task_tree(task_tree_id, commit=False)
+        if tracking is None:
+            return None
+        
+        counts = {
+            "system": await self.decrement_concurrency("system", "global", 1, commit=False),
+            "user": await self.decrement_concurrency("user", user_id, 1, commit=False),
+        }
+        
+        await self.session.commit()
+        return counts
+    
+    async def release_stale_task_trees(
+        self,
+        started_before: datetime
+    ) -> Dict[Tuple[str, str], int]:
+        """
+        Complete active task trees started before a cutoff and free their slots
+        
+        Covers trees whose completion was never reported (crashed worker,
+        lost hook). Marking them and decrementing the concurrency counters
+        happens in one transaction.
+        
+        Args:
+            started_before: Active trees started before this time are released
+            
+        Returns:
+            Post-decrement concurrency counts keyed by (scope, identifier);
+            empty when nothing was released
+        """
+        stmt = (
+            update(TaskTreeTracking)
+            .where(
+                and_(
+                    TaskTreeTracking.completed_at.is_(None),
+                    TaskTreeTracking.started_at < started_before,
+                )
+            )
+            .values(completed_at=datetime.now(timezone.utc))
+            .returning(TaskTreeTracking.user_id)
+        )
+        result = await self.session.execute(stmt)
+        user_ids = result.scalars().all()
+        if not user_ids:
+            await self.session.rollback()
+            return {}
+        
+        released: Dict[str, int] = {}
+        for user_id in user_ids:
+            released[user_id] = released.get(user_id, 0) + 1
+        
+        counts = {
+            ("system", "global"): await self.decrement_concurrency("system", "global", len(user_ids), commit=False)
+        }
+        for user_id, amount in released.items():
+            counts[("user", user_id)] = await self.decrement_concurrency("user", user_id, amount, commit=False)
+        
+        await self.session.commit()
+        return counts
+    
     async def get_active_task_tree(
         self,
         task_tree_id: str
@@ -213,16 +439,10 @@ class QuotaRepository:
         """
         Get active task tree tracking
         """
-        stmt = select(TaskTreeTracking).filter(
-            and_(
-                TaskTreeTracking.task_tree_id == task_tree_id,
-                TaskTreeTracking.completed_at.is_(None),
-            )
-        )
-        
-        result = await self.session.execute(stmt)
-            
-        return result.scalar_one_or_none()
+        tracking = await self.session.get(TaskTreeTracking, task_tree_id)
+        if tracking is None or tracking.completed_at is not None:
+            return None
+        return tracking
     
     async def get_user_active_task_trees(
         self,
@@ -230,8 +450,11 @@ class QuotaRepository:
     ) -> List[TaskTreeTracking]:
         """
         Get all active task trees for a user
+        
+        Lazy loads are disabled with raiseload so that relationships added
+        later must be eager-loaded (selectinload) instead of issuing N+1 queries.
         """
-        stmt = select(TaskTreeTracking).filter(
+        stmt = select(TaskTreeTracking).options(raiseload("*")).filter(
             and_(
                 TaskTreeTracking.user_id == user_id,
                 TaskTreeTracking.completed_at.is_(None),
@@ -247,38 +470,18 @@ class QuotaRepository:
         date: str,
         stat_type: str,
         identifier: str,
-        amount: int = 1
+        amount: int = 1,
+        commit: bool = True,
     ) -> int:
         """
         Increment usage statistic
         """
-        stmt = select(UsageStats).filter(
-            and_(
-                UsageStats.date == date,
-                UsageStats.stat_type == stat_type,
-                UsageStats.identifier == identifier,
-            )
+        return await self._upsert_count(
+            _usage_stats,
+            ["date", "stat_type", "identifier"],
+            {"date": date, "stat_type": stat_type, "identifier": identifier, "count": amount},
+            commit=commit,
         )
-        
-        result = await self.session.execute(stmt)
-            
-        stat = result.scalar_one_or_none()
-        
-        if stat:
-            stat.count += amount
-            stat.updated_at = datetime.now(timezone.utc)
-        else:
-            stat = UsageStats(
-                date=date,
-                stat_type=stat_type,
-                identifier=identifier,
-                count=amount,
-            )
-            self.session.add(stat)
-        
-        await self.session.commit()
-            
-        return stat.count
     
     async def get_usage_stat(
         self,
@@ -289,24 +492,23 @@ class QuotaRepository:
         """
         Get usage statistic
         """
-        stmt = select(UsageStats).filter(
-            and_(
-                UsageStats.date == date,
-                UsageStats.stat_type == stat_type,
-                UsageStats.identifier == identifier,
-            )
+        stmt = select(_usage_stats.c.count).where(
+            _usage_stats.c.date == date,
+            _usage_stats.c.stat_type == stat_type,
+            _usage_stats.c.identifier == identifier,
         )
-        
         result = await self.session.execute(stmt)
-            
-        stat = result.scalar_one_or_none()
-        return stat.count if stat else 0
+        return result.scalar() or 0
     
     async def cleanup_old_data(self, days_to_keep: int = 30) -> int:
         """
         Clean up old quota and usage data
+        
+        On PostgreSQL the three deletes run as one statement (data-modifying
+        CTEs); other databases run them in sequence within one transaction.
         """
-        cutoff_date = (datetime.now(timezone.utc) - timedelta(days=days_to_keep)).date().isoformat()
+        cutoff_day = (datetime.now(timezone.utc) - timedelta(days=days_to_keep)).date()
+        cutoff_date = cutoff_day.isoformat()
         
         # Delete old quota counters
         quota_stmt = delete(QuotaCounter).where(QuotaCounter.date < cutoff_date)
@@ -314,6 +516,25 @@ class QuotaRepository:
         # Delete old usage stats
         usage_stmt = delete(UsageStats).where(UsageStats.date < cutoff_date)
         
+        if self.session.get_bind().dialect.name == "postgresql":
+            # Delete completed task tree tracking older than cutoff
+            tracking_stmt = delete(TaskTreeTracking).where(
+                TaskTreeTracking.completed_at.isnot(None),
+                cast(TaskTreeTracking.completed_at, Date) < cutoff_day,
+            )
+            quota_cte = quota_stmt.returning(literal_column("1")).cte("q")
+            usage_cte = usage_stmt.returning(literal_column("1")).cte("u")
+            tracking_cte = tracking_stmt.returning(literal_column("1")).cte("t")
+            count_stmt = select(
+                select(sql_func.count()).select_from(quota_cte).scalar_subquery()
+                + select(sql_func.count()).select_from(usage_cte).scalar_subquery()
+                + select(sql_func.count()).select_from(tracking_cte).scalar_subquery()
+            )
+            result = await self.session.execute(count_stmt)
+            total = result.scalar() or 0
+            await self.session.commit()
+            return total
+        
         # Delete completed task tree tracking older than cutoff
         tracking_stmt = delete(TaskTreeTracking).where(
             and_(
@@ -328,4 +549,3 @@ class QuotaRepository:
         await self.session.commit()
             
         return r1.rowcount + r2.rowcount + r3.rowcount
-
@@ -0,0 +1,88 @@
+"""
+Request-scoped sharing of a pooled database session
+
+Storage calls made while checking one request (counter reads, stale slot
+release, task existence probes) can reuse a single pooled session instead of
+checking one out per call. Code that may run inside a scope opens sessions
+through pooled_session(); outside a scope it falls back to
+create_pooled_session().
+"""
+
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar, Token
+from typing import Any, AsyncIterator, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from apflow.core.storage import create_pooled_session
+
+_current_scope: ContextVar[Optional["SessionScope"]] = ContextVar("demo_session_scope", default=None)
+
+
+class SessionScope:
+    """
+    Lazily opened pooled session shared by pooled_session() callers
+
+    Only the task that entered the scope reuses the session: tasks spawned
+    inside it inherit the context variable but get their own sessions, since
+    a session must not be used concurrently. Close the scope before handing
+    off to long-running work so the connection is not held idle.
+    """
+
+    def __init__(self):
+        self._owner: Optional[asyncio.Task] = None
+        self._token: Optional[Token] = None
+        self._stack = AsyncExitStack()
+        self._session: Any = None
+
+    async def __aenter__(self) -> "SessionScope":
+        self.start()
+        return self
+
+    def start(self) -> None:
+        """Share this scope's session with pooled_session() calls in the current task"""
+        self._owner = asyncio.current_task()
+        self._token = _current_scope.set(self)
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    @property
+    def active(self) -> bool:
+        """Whether pooled_session() in the current task reuses this scope's session"""
+        return self._token is not None and self._owner is asyncio.current_task()
+
+    async def close(self) -> None:
+        """Release the shared session and stop sharing it (safe to call twice)"""
+        if self._token is not None:
+            _current_scope.reset(self._token)
+            self._token = None
+        self._session = None
+        await self._stack.aclose()
+
+    async def _get_session(self) -> Any:
+        if self._session is None:
+            self._session = await self._stack.enter_async_context(create_pooled_session())
+        return self._session
+
+
+@asynccontextmanager
+async def pooled_session() -> AsyncIterator[Any]:
+    """Yield the current scope's shared session, or a fresh pooled session"""
+    scope = _current_scope.get()
+    if scope is None or not scope.active:
+        async with create_pooled_session() as session:
+            yield session
+        return
+
+    session = await scope._get_session()
+    try:
+        yield session
+    except Exception:
+        # Leave the shared session usable for the next caller
+        if isinstance(session, AsyncSession):
+            await session.rollback()
+        else:
+            session.rollback()
+        raise
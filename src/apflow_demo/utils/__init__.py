@@ -10,6 +10,7 @@ from apflow_demo.utils.user_identification import (
 from apflow_demo.utils.jwt_utils import (
     generate_demo_jwt_token,
     verify_demo_jwt_token,
+    verify_token_cached,
     get_user_id_from_token,
 )
 
@@ -19,6 +20,7 @@ __all__ = [
     "generate_user_id_from_fingerprint",
     "generate_demo_jwt_token",
     "verify_demo_jwt_token",
+    "verify_token_cached",
     "get_user_id_from_token",
 ]
 
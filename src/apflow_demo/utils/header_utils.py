@@ -7,6 +7,17 @@ Uses apflow's built-in LLM key detection.
 from typing import Optional
 from starlette.requests import Request
 
+from apflow_demo.utils.user_identification import generate_user_id_from_fingerprint
+
+try:
+    from apflow.core.utils.llm_key_context import get_llm_key_from_header
+except ImportError:
+    # Fallback if apflow is not available (shouldn't happen)
+    get_llm_key_from_header = None
+
+# Header carrying a user-supplied LLM key (Starlette header lookup is case-insensitive)
+_LLM_KEY_HEADER = "X-LLM-API-KEY"
+
 
 def has_llm_key_in_header(request: Request) -> bool:
     """
@@ -21,25 +32,14 @@ def has_llm_key_in_header(request: Request) -> bool:
     Returns:
         True if LLM key is present in headers
     """
+    # Cheapest check first: the header itself (also covers the case where
+    # LLMAPIKeyMiddleware hasn't processed the request yet)
+    if request.headers.get(_LLM_KEY_HEADER):
+        return True
+    
     # Use apflow's built-in LLM key detection
     # LLMAPIKeyMiddleware extracts X-LLM-API-KEY header and stores it in context
-    try:
-        from apflow.core.utils.llm_key_context import get_llm_key_from_header
-        
-        # Check if LLM key is available in context (set by LLMAPIKeyMiddleware)
-        llm_key = get_llm_key_from_header()
-        if llm_key:
-            return True
-        
-        # Fallback: Check header directly (in case middleware hasn't run yet)
-        # This handles the case where we're checking before middleware processes the request
-        if request.headers.get("X-LLM-API-KEY") or request.headers.get("x-llm-api-key"):
-            return True
-        
-        return False
-    except ImportError:
-        # Fallback if apflow is not available (shouldn't happen)
-        return bool(request.headers.get("X-LLM-API-KEY") or request.headers.get("x-llm-api-key"))
+    return bool(get_llm_key_from_header is not None and get_llm_key_from_header())
 
 
 def extract_llm_key_from_header(request: Request) -> Optional[str]:
@@ -54,19 +54,14 @@ def extract_llm_key_from_header(request: Request) -> Optional[str]:
     Returns:
         LLM API key if found, None otherwise
     """
-    try:
-        from apflow.core.utils.llm_key_context import get_llm_key_from_header
-        
+    if get_llm_key_from_header is not None:
         # Get from context (set by LLMAPIKeyMiddleware)
         llm_key = get_llm_key_from_header()
         if llm_key:
             return llm_key
-        
-        # Fallback: Check header directly
-        return request.headers.get("X-LLM-API-KEY") or request.headers.get("x-llm-api-key")
-    except ImportError:
-        # Fallback if apflow is not available
-        return request.headers.get("X-LLM-API-KEY") or request.headers.get("x-llm-api-key")
+    
+    # Fallback: Check header directly (one case-insensitive lookup)
+    return request.headers.get(_LLM_KEY_HEADER)
 
 
 def extract_user_id_from_request(request: Request) -> Optional[str]:
@@ -91,6 +86,11 @@ def extract_user_id_from_request(request: Request) -> Optional[str]:
     if user_id:
         return user_id
     
+    # Fallback result cached earlier in this request (skips JWT decode / hashing)
+    user_id = getattr(request.state, "_demo_fallback_user_id", None)
+    if user_id:
+        return user_id
+    
     # Priority 2: Try to extract from JWT token in cookie
     # This handles the case where cookie exists but JWT middleware hasn't processed it yet
     jwt_token = request.cookies.get("authorization")
@@ -98,11 +98,12 @@ def extract_user_id_from_request(request: Request) -> Optional[str]:
         from apflow_demo.utils.jwt_utils import get_user_id_from_token
         user_id = get_user_id_from_token(jwt_token)
         if user_id:
+            request.state._demo_fallback_user_id = user_id
             return user_id
     
     # Priority 3: Generate from browser fingerprint (will be set as JWT cookie in middleware)
     # This ensures we always have a user_id, even for first-time visitors
-    from apflow_demo.utils.user_identification import generate_user_id_from_fingerprint
     fingerprint_id = generate_user_id_from_fingerprint(request.headers)
+    request.state._demo_fallback_user_id = fingerprint_id
     return fingerprint_id
 
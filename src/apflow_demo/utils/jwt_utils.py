@@ -7,11 +7,58 @@ for apflow's JWT middleware.
 Uses apflow's generate_token and verify_token functions for consistency.
 """
 
-from typing import Optional, Dict, Any
+import hashlib
+import time
+from functools import lru_cache
+from typing import Optional, Dict, Any, Tuple
 from apflow.api.a2a.server import generate_token, verify_token
 from apflow_demo.config.settings import settings
 
 
+# Successful verifications: digest of (algorithm, secret, token) -> (payload, expiry)
+_verified_tokens: Dict[bytes, Tuple[Dict[str, Any], float]] = {}
+_VERIFIED_TOKEN_TTL = 30
+_VERIFIED_TOKENS_MAX = 10000
+
+
+def verify_token_cached(token: str, secret: str, algorithm: str) -> Optional[Dict[str, Any]]:
+    """
+    apflow's verify_token() with successful results cached for a short TTL
+    
+    The same cookie token arrives with every request from a browser, so
+    repeat verifications become a dict lookup instead of an HMAC check and
+    claim validation. Entries never outlive the token's own exp claim.
+    Failures are not cached, so a token that becomes valid later is not
+    rejected from cache.
+    
+    Args:
+        token: JWT token string
+        secret: Signing secret
+        algorithm: JWT algorithm (e.g. HS256)
+        
+    Returns:
+        Copy of the token payload if valid, None otherwise
+    """
+    key = hashlib.sha256(f"{algorithm}:{secret}:{token}".encode()).digest()[:16]
+    now = time.time()
+    cached = _verified_tokens.get(key)
+    if cached is not None:
+        if cached[1] > now:
+            return dict(cached[0])
+        del _verified_tokens[key]
+    
+    payload = verify_token(token, secret, algorithm)
+    if payload:
+        expires_at = now + _VERIFIED_TOKEN_TTL
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        if len(_verified_tokens) >= _VERIFIED_TOKENS_MAX:
+            _verified_tokens.clear()
+        _verified_tokens[key] = (dict(payload), expires_at)
+    return payload
+
+
 def generate_demo_jwt_token(user_id: str, expires_in_days: int = 365) -> str:
     """
     Generate JWT token for demo user
@@ -42,6 +89,28 @@ def generate_demo_jwt_token(user_id: str, expires_in_days: int = 365) -> str:
     return token
 
 
+@lru_cache(maxsize=16384)
+def _demo_jwt_token_for_hour(user_id: str, expires_in_days: int, hour: int) -> str:
+    return generate_demo_jwt_token(user_id, expires_in_days)
+
+
+def get_demo_jwt_token(user_id: str, expires_in_days: int = 365) -> str:
+    """
+    Get a JWT token for demo user, reusing one issued within the current hour
+    
+    Signing is skipped for repeat first visits from the same browser; the
+    reused token's iat/exp are at most one hour older than a fresh one.
+    
+    Args:
+        user_id: User ID (from browser fingerprint or cookie)
+        expires_in_days: Token expiration in days (default: 365 days / 1 year)
+        
+    Returns:
+        JWT token string
+    """
+    return _demo_jwt_token_for_hour(user_id, expires_in_days, int(time.time() // 3600))
+
+
 def verify_demo_jwt_token(token: str) -> Optional[Dict[str, Any]]:
     """
     Verify JWT token and return payload
@@ -60,17 +129,19 @@ def verify_demo_jwt_token(token: str) -> Optional[Dict[str, Any]]:
     secret_key = settings.apflow_jwt_secret_key
     algorithm = settings.apflow_jwt_algorithm
     
-    # Use apflow's verify_token (uses python-jose internally)
+    # Use apflow's verify_token (uses python-jose internally), cached per token
     # It handles all error cases and returns None on failure
-    return verify_token(token, secret_key, algorithm)
+    return verify_token_cached(token, secret_key, algorithm)
 
 
+@lru_cache(maxsize=16384)
 def get_user_id_from_token(token: str) -> Optional[str]:
     """
     Extract user_id from JWT token without verification
     
     Useful for reading user_id from cookie before verification.
-    Uses python-jose for consistency with apflow.
+    Uses python-jose for consistency with apflow. Memoized, since the same
+    cookie token arrives with every request from a browser.
     
     Args:
         token: JWT token string
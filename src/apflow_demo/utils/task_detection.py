@@ -4,6 +4,8 @@ Task tree detection utilities
 Detects whether tasks or task trees are LLM-consuming.
 """
 
+import re
+from functools import lru_cache
 from typing import Dict, Any, Optional, List
 from apflow.core.types import TaskTreeNode
 from apflow.core.storage.sqlalchemy.models import TaskModel
@@ -28,6 +30,25 @@ LLM_EXECUTOR_TYPES = {
     "agent",
 }
 
+# LLM-related keywords matched anywhere in a method name (one regex scan
+# instead of a substring test per keyword)
+_LLM_METHOD_KEYWORDS = re.compile("llm|openai|anthropic|crewai|generate")
+
+
+@lru_cache(maxsize=1024)
+def _is_llm_signature(method: str, task_type: str, executor_id: str = "") -> bool:
+    """
+    Classify a task by its lower-cased method, type and executor ID
+
+    Tasks in a tree repeat a handful of executors, so the result is cached
+    per distinct combination.
+    """
+    if executor_id in LLM_EXECUTOR_IDS or method in LLM_EXECUTOR_IDS:
+        return True
+    if task_type in LLM_EXECUTOR_TYPES:
+        return True
+    return bool(method and _LLM_METHOD_KEYWORDS.search(method))
+
 
 def is_llm_consuming_task_schema(schemas: Optional[Dict[str, Any]]) -> bool:
     """
@@ -42,21 +63,8 @@ def is_llm_consuming_task_schema(schemas: Optional[Dict[str, Any]]) -> bool:
     if not schemas:
         return False
     
-    # Check method in schemas (can be executor id)
-    method = schemas.get("method", "").lower()
-    if method in LLM_EXECUTOR_IDS:
-        return True
-    
-    # Check type in schemas
-    task_type = schemas.get("type", "").lower()
-    if task_type in LLM_EXECUTOR_TYPES:
-        return True
-    
-    # Check if method contains LLM-related keywords
-    if method and any(keyword in method for keyword in ["llm", "openai", "anthropic", "crewai", "generate"]):
-        return True
-    
-    return False
+    # Method (can be executor id), type, or LLM-related keywords in the method
+    return _is_llm_signature(schemas.get("method", "").lower(), schemas.get("type", "").lower())
 
 
 def is_llm_consuming_task(task: TaskModel) -> bool:
@@ -72,35 +80,21 @@ def is_llm_consuming_task(task: TaskModel) -> bool:
     schemas = task.schemas or {}
     params = task.params or {}
     
-    # Check executor_id in params
+    # Check executor_id in params, method (can be executor id) and type in
+    # schemas, and LLM-related keywords in the method
     executor_id = params.get("executor_id")
-    if executor_id and executor_id.lower() in LLM_EXECUTOR_IDS:
-        return True
-    
-    # Check method in schemas (can be executor id)
-    method = schemas.get("method", "").lower()
-    if method in LLM_EXECUTOR_IDS:
-        return True
-    
-    # Check type in schemas
-    task_type = schemas.get("type", "").lower()
-    if task_type in LLM_EXECUTOR_TYPES:
+    if _is_llm_signature(
+        schemas.get("method", "").lower(),
+        schemas.get("type", "").lower(),
+        executor_id.lower() if executor_id else "",
+    ):
         return True
     
-    # Check if method contains LLM-related keywords
-    if method and any(keyword in method for keyword in ["llm", "openai", "anthropic", "crewai", "generate"]):
+    # CrewAI works configuration indicates LLM usage (same rule as
+    # detect_task_tree_from_tasks_array)
+    if params.get("works"):
         return True
     
-    # Check params for LLM-related configuration
-    if params:
-        params_str = str(params).lower()
-        if any(keyword in params_str for keyword in ["llm", "openai", "anthropic", "crewai", "model"]):
-            # Check if it's actually LLM-related (not just a string containing the word)
-            works = params.get("works", {})
-            if works:
-                # CrewAI works configuration indicates LLM usage
-                return True
-    
     return False
 
 
@@ -160,23 +154,12 @@ def detect_task_tree_from_tasks_array(tasks: List[Dict[str, Any]]) -> bool:
         schemas = task_dict.get("schemas", {})
         params = task_dict.get("params", {})
         
-        # Check executor_id
-        executor_id = params.get("executor_id", "").lower()
-        if executor_id in LLM_EXECUTOR_IDS:
-            return True
-        
-        # Check method
-        method = schemas.get("method", "").lower()
-        if method in LLM_EXECUTOR_IDS:
-            return True
-        
-        # Check type
-        task_type = schemas.get("type", "").lower()
-        if task_type in LLM_EXECUTOR_TYPES:
-            return True
-        
-        # Check for LLM keywords
-        if method and any(keyword in method for keyword in ["llm", "openai", "anthropic", "crewai", "generate"]):
+        # Check executor_id, method, type and LLM keywords in the method
+        if _is_llm_signature(
+            schemas.get("method", "").lower(),
+            schemas.get("type", "").lower(),
+            params.get("executor_id", "").lower(),
+        ):
             return True
         
         # Check params for works configuration (CrewAI)
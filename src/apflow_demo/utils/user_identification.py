@@ -8,12 +8,44 @@ Cookie: demo_user_id (httponly, max_age=1 year)
 """
 
 import hashlib
-import uuid
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
 from starlette.requests import Request
 from starlette.datastructures import Headers
 
 
+# Headers making up the browser fingerprint (order matters for consistency)
+_FINGERPRINT_HEADERS = (
+    "User-Agent",
+    "Accept-Language",
+    "Accept-Encoding",
+    "Accept",
+    "Sec-CH-UA",  # Client Hints
+    "Sec-CH-UA-Mobile",
+    "Sec-CH-UA-Platform",
+)
+
+
+@lru_cache(maxsize=16384)
+def _fingerprint_user_id(fingerprint_components: Tuple[str, ...]) -> str:
+    """
+    Derive the user ID for a fingerprint (memoized: repeat visitors skip join and hash)
+    
+    Args:
+        fingerprint_components: Header values in _FINGERPRINT_HEADERS order
+        
+    Returns:
+        User ID string (format: "demo_user_{hash}")
+    """
+    # One join + encode is cheaper than feeding the hasher per component.
+    # The separators keep the string non-empty even when every header is
+    # missing, so there is always something stable to hash.
+    fingerprint_bytes = "|".join(fingerprint_components).encode()
+    
+    # Generate consistent hash (16 hex chars for readability)
+    return f"demo_user_{hashlib.blake2b(fingerprint_bytes, digest_size=8).hexdigest()}"
+
+
 def generate_user_id_from_fingerprint(headers: Headers) -> str:
     """
     Generate stable user ID from browser fingerprint
@@ -27,27 +59,24 @@ def generate_user_id_from_fingerprint(headers: Headers) -> str:
     Returns:
         User ID string (format: "demo_user_{hash}")
     """
-    # Collect fingerprint components (order matters for consistency)
-    fingerprint_components = [
-        headers.get("User-Agent", ""),
-        headers.get("Accept-Language", ""),
-        headers.get("Accept-Encoding", ""),
-        headers.get("Accept", ""),
-        headers.get("Sec-CH-UA", ""),  # Client Hints
-        headers.get("Sec-CH-UA-Mobile", ""),
-        headers.get("Sec-CH-UA-Platform", ""),
-    ]
-    
-    # Create fingerprint string
-    fingerprint_string = "|".join(fingerprint_components)
+    return _fingerprint_user_id(tuple(headers.get(name, "") for name in _FINGERPRINT_HEADERS))
+
+
+def _cookie_or_fingerprint_user_id(request: Request) -> str:
+    """
+    Resolve user ID from the demo_user_id cookie or the browser fingerprint
     
-    if not fingerprint_string.strip():
-        # Fallback: generate random ID
-        return f"demo_user_{uuid.uuid4().hex[:16]}"
+    The result is cached on request.state so repeat calls within the same
+    request (middleware, routes) skip the cookie lookup and hashing.
+    """
+    user_id = getattr(request.state, "_demo_user_id", None)
+    if user_id is not None:
+        return user_id
     
-    # Generate consistent hash (use first 16 chars for readability)
-    fingerprint_hash = hashlib.sha256(fingerprint_string.encode()).hexdigest()[:16]
-    return f"demo_user_{fingerprint_hash}"
+    # Check cookie first, then generate from fingerprint
+    user_id = request.cookies.get("demo_user_id") or generate_user_id_from_fingerprint(request.headers)
+    request.state._demo_user_id = user_id
+    return user_id
 
 
 def get_or_create_user_id(request: Request) -> str:
@@ -62,13 +91,8 @@ def get_or_create_user_id(request: Request) -> str:
     Returns:
         User ID string
     """
-    # Check if cookie already exists
-    user_id = request.cookies.get("demo_user_id")
-    if user_id:
-        return user_id
-    
-    # Generate from fingerprint (will be set as cookie in middleware)
-    return generate_user_id_from_fingerprint(request.headers)
+    # Cookie if it exists, otherwise fingerprint (will be set as cookie in middleware)
+    return _cookie_or_fingerprint_user_id(request)
 
 
 def generate_user_id_from_request(request: Request) -> str:
@@ -85,11 +109,5 @@ def generate_user_id_from_request(request: Request) -> str:
     Returns:
         User ID string
     """
-    # Check cookie first
-    user_id = request.cookies.get("demo_user_id")
-    if user_id:
-        return user_id
-    
-    # Generate from fingerprint
-    return generate_user_id_from_fingerprint(request.headers)
+    return _cookie_or_fingerprint_user_id(request)
 
@@ -0,0 +1,53 @@
+"""
+Tests for the write-behind counter flusher
+"""
+
+from unittest import mock
+
+import pytest
+
+from apflow_demo.storage.counter_cache import counter_cache
+from apflow_demo.storage.counter_flusher import CounterFlusher
+from apflow_demo.storage.models import QuotaCounter
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_invalidates_cached_counters():
+    """A batch that cannot be written no longer inflates cached values"""
+    key = ("u1", "2026-01-01", "total")
+    counter_cache.clear()
+    counter_cache.set(QuotaCounter, key, 5)
+    flusher = CounterFlusher()
+
+    with mock.patch(
+        "apflow_demo.storage.counter_flusher.create_pooled_session",
+        side_effect=RuntimeError("database unavailable"),
+    ):
+        await flusher.enqueue_quota(*key)
+        assert counter_cache.get(QuotaCounter, key) == 6
+        await flusher.close()
+
+    assert counter_cache.get(QuotaCounter, key) is None
+    counter_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_is_retried():
+    """Increments from a failed write are re-queued and written on retry"""
+    key = ("u2", "2026-01-01", "total")
+    counter_cache.clear()
+    counter_cache.set(QuotaCounter, key, 5)
+    flusher = CounterFlusher()
+
+    session = mock.AsyncMock()
+    sessions = [RuntimeError("database unavailable"), session]
+    with mock.patch(
+        "apflow_demo.storage.counter_flusher.create_pooled_session", side_effect=sessions
+    ), mock.patch("apflow_demo.storage.counter_flusher.QuotaRepository") as repository:
+        repository.return_value.apply_counter_deltas = mock.AsyncMock()
+        await flusher.enqueue_quota(*key)
+        await flusher.close()
+
+    repository.return_value.apply_counter_deltas.assert_awaited_once_with({QuotaCounter: {key: 1}})
+    assert counter_cache.get(QuotaCounter, key) == 6
+    counter_cache.clear()
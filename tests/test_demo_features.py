@@ -2,6 +2,10 @@
 Tests for demo features
 """
 
+import os
+import subprocess
+import sys
+
 import pytest
 from apflow_demo.extensions.rate_limiter import RateLimiter
 from apflow_demo.config.settings import settings
@@ -19,3 +23,16 @@ def test_settings():
     assert isinstance(settings.demo_mode, bool)
     assert isinstance(settings.rate_limit_enabled, bool)
 
+
+def test_import_does_not_build_settings(tmp_path):
+    """Importing the package leaves the environment and .env untouched"""
+    code = (
+        "import apflow_demo\n"
+        "from apflow_demo.config.settings import get_settings\n"
+        "assert get_settings.cache_info().currsize == 0\n"
+    )
+    # Fresh interpreter: this test process has already built the settings
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, check=True)
+    assert not (tmp_path / ".env").exists()
+
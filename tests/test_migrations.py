@@ -0,0 +1,91 @@
+"""
+Tests for demo schema migrations on existing databases
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+
+pytest.importorskip("duckdb_engine")
+
+from apflow_demo.storage.migrations import _column_type, _migrate  # noqa: E402
+
+# demo_task_tree_tracking as created before is_llm_consuming became BOOLEAN
+_BASELINE_TASK_TREE_TRACKING = [
+    "CREATE TABLE demo_task_tree_tracking ("
+    "task_tree_id VARCHAR(255) NOT NULL PRIMARY KEY, "
+    "user_id VARCHAR(255) NOT NULL, "
+    "is_llm_consuming VARCHAR(10) NOT NULL, "
+    "started_at TIMESTAMPTZ NOT NULL DEFAULT now(), "
+    "completed_at TIMESTAMPTZ)",
+    "CREATE INDEX ix_demo_task_tree_tracking_task_tree_id ON demo_task_tree_tracking (task_tree_id)",
+    "CREATE INDEX ix_demo_task_tree_tracking_user_id ON demo_task_tree_tracking (user_id)",
+    "CREATE INDEX idx_task_tree_user ON demo_task_tree_tracking (user_id)",
+    "CREATE INDEX idx_task_tree_active ON demo_task_tree_tracking (user_id, completed_at)",
+]
+
+
+@pytest.fixture
+def legacy_engine():
+    """In-memory DuckDB engine holding a baseline demo_task_tree_tracking table"""
+    engine = create_engine("duckdb:///:memory:")
+    with engine.begin() as conn:
+        for statement in _BASELINE_TASK_TREE_TRACKING:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO demo_task_tree_tracking (task_tree_id, user_id, is_llm_consuming) "
+            "VALUES ('t1', 'u1', 'true'), ('t2', 'u1', 'false')"
+        ))
+    yield engine
+    engine.dispose()
+
+
+def test_migrate_converts_indexed_llm_flag_on_duckdb(legacy_engine):
+    """The VARCHAR flag becomes BOOLEAN and the table keeps its indexes"""
+    with legacy_engine.begin() as conn:
+        _migrate(conn, "duckdb")
+
+    with legacy_engine.connect() as conn:
+        column_type = _column_type(conn, "demo_task_tree_tracking", "is_llm_consuming")
+        assert column_type.lower() == "boolean"
+        rows = conn.execute(text(
+            "SELECT task_tree_id, is_llm_consuming FROM demo_task_tree_tracking ORDER BY task_tree_id"
+        )).all()
+        assert [tuple(row) for row in rows] == [("t1", True), ("t2", False)]
+        indexes = conn.execute(text(
+            "SELECT index_name FROM duckdb_indexes() WHERE table_name = 'demo_task_tree_tracking'"
+        )).scalars().all()
+        assert sorted(indexes) == [
+            "idx_task_tree_active",
+            "idx_task_tree_user",
+            "ix_demo_task_tree_tracking_task_tree_id",
+            "ix_demo_task_tree_tracking_user_id",
+        ]
+
+
+def test_migrate_is_idempotent_on_duckdb(legacy_engine):
+    """A second run finds the BOOLEAN column and changes nothing"""
+    with legacy_engine.begin() as conn:
+        _migrate(conn, "duckdb")
+    with legacy_engine.begin() as conn:
+        _migrate(conn, "duckdb")
+
+    with legacy_engine.connect() as conn:
+        assert conn.execute(text(
+            "SELECT count(*) FROM demo_task_tree_tracking WHERE is_llm_consuming"
+        )).scalar() == 1
+
+
+def test_migrate_ignores_same_named_table_in_other_schema(legacy_engine):
+    """Only the table in the current schema decides whether to convert"""
+    with legacy_engine.begin() as conn:
+        conn.execute(text("CREATE SCHEMA archive"))
+        conn.execute(text(
+            "CREATE TABLE archive.demo_task_tree_tracking "
+            "(task_tree_id VARCHAR(255) PRIMARY KEY, is_llm_consuming BOOLEAN)"
+        ))
+        assert _column_type(conn, "demo_task_tree_tracking", "is_llm_consuming").lower() == "varchar"
+        _migrate(conn, "duckdb")
+
+    with legacy_engine.connect() as conn:
+        column_type = _column_type(conn, "demo_task_tree_tracking", "is_llm_consuming")
+        assert column_type.lower() == "boolean"
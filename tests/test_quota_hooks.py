@@ -0,0 +1,38 @@
+"""
+Tests for the task tree lifecycle quota hook
+"""
+
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from apflow_demo.config.settings import settings
+from apflow_demo.extensions.quota_hooks import quota_tracking_on_tree_completed
+from apflow_demo.extensions.rate_limiter import RateLimiter
+
+
+@pytest.fixture
+def complete_task_tree():
+    """RateLimiter.complete_task_tree replaced by a mock, with rate limiting on"""
+    with mock.patch.object(settings, "rate_limit_enabled", True), mock.patch.object(
+        RateLimiter, "complete_task_tree", new_callable=mock.AsyncMock
+    ) as complete:
+        yield complete
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", ["completed", "failed", "cancelled"])
+async def test_terminal_status_releases_task_tree(complete_task_tree, status):
+    """Failed and cancelled trees free their concurrency slot like completed ones"""
+    root_task = SimpleNamespace(id="t1", user_id="u1")
+    await quota_tracking_on_tree_completed(root_task, status)
+    complete_task_tree.assert_awaited_once_with(user_id="u1", task_tree_id="t1")
+
+
+@pytest.mark.asyncio
+async def test_non_terminal_status_keeps_task_tree(complete_task_tree):
+    """A tree that is still running keeps its slot"""
+    root_task = SimpleNamespace(id="t1", user_id="u1")
+    await quota_tracking_on_tree_completed(root_task, "in_progress")
+    complete_task_tree.assert_not_awaited()
@@ -0,0 +1,183 @@
+"""
+Tests for QuotaLimitMiddleware request replay and response rewriting
+"""
+
+from typing import Iterator, List
+from unittest import mock
+
+import orjson
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from apflow_demo.api.middleware import quota_limit
+from apflow_demo.api.middleware.quota_limit import QuotaLimitMiddleware
+from apflow_demo.config.settings import settings
+from apflow_demo.extensions.rate_limiter import RateLimiter
+
+QUOTA_INFO = {"allowed": True, "total_count": 2, "total_limit": 10, "llm_count": 0, "llm_limit": 1}
+CONCURRENCY_INFO = {"allowed": True, "user_current": 0, "user_limit": 1}
+
+# Received request bodies, per test
+received: List[bytes] = []
+
+
+async def echo_json(request: Request) -> Response:
+    """Echo the request body back inside a JSON-RPC result"""
+    body = await request.body()
+    received.append(body)
+    payload = orjson.loads(body)
+    return Response(
+        orjson.dumps({"jsonrpc": "2.0", "id": payload.get("id"), "result": {"root_task_id": "t1"}}),
+        media_type="application/json",
+    )
+
+
+async def echo_raw(request: Request) -> Response:
+    """Echo the request body back unchanged"""
+    body = await request.body()
+    received.append(body)
+    return Response(body, media_type="application/json")
+
+
+async def plain_text(request: Request) -> Response:
+    """Answer with a non-JSON body"""
+    received.append(await request.body())
+    return PlainTextResponse("not json")
+
+
+async def event_stream(request: Request) -> Response:
+    """Answer with a server-sent event stream"""
+    received.append(await request.body())
+
+    async def events():
+        for i in range(3):
+            yield f"data: {i}\n\n".encode()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+app = Starlette(routes=[
+    Route("/json", echo_json, methods=["POST"]),
+    Route("/raw", echo_raw, methods=["POST"]),
+    Route("/text", plain_text, methods=["POST"]),
+    Route("/stream", event_stream, methods=["POST"]),
+])
+app.add_middleware(QuotaLimitMiddleware)
+
+
+def _chunks(body: bytes, size: int = 100) -> Iterator[bytes]:
+    """Split a body so the middleware sees several http.request messages"""
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def _task_request(method: str = "tasks.execute") -> bytes:
+    """A JSON-RPC task request well over the 256-byte method sniff"""
+    tasks = [{"id": "t1", "name": "info", "schemas": {"method": "system_info_executor"}}]
+    return orjson.dumps({
+        "jsonrpc": "2.0",
+        "id": 7,
+        "method": method,
+        "params": {"tasks": tasks, "padding": "x" * 400},
+    })
+
+
+@pytest.fixture
+def limiter():
+    """Rate limiting enabled, with the limiter and user lookup replaced"""
+    received.clear()
+    with mock.patch.object(settings, "rate_limit_enabled", True), \
+            mock.patch.object(
+                RateLimiter, "check_task_tree_limits", new_callable=mock.AsyncMock,
+                return_value=((True, dict(QUOTA_INFO)), (True, dict(CONCURRENCY_INFO))),
+            ) as check, \
+            mock.patch.object(RateLimiter, "start_task_tree", new_callable=mock.AsyncMock) as start, \
+            mock.patch.object(quota_limit, "extract_user_id_from_request", return_value="u1"), \
+            mock.patch.object(quota_limit, "has_llm_key_in_header", return_value=False):
+        yield check, start
+
+
+@pytest.fixture
+def client():
+    """TestClient over the middleware-wrapped app"""
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_non_task_method_body_is_replayed_in_full(limiter, client):
+    """A long non-task request reaches the route byte for byte after the sniff"""
+    check, start = limiter
+    body = orjson.dumps({"jsonrpc": "2.0", "id": 1, "method": "tasks.list", "params": {"padding": "y" * 600}})
+    assert len(body) > quota_limit._SNIFF_BYTES
+
+    response = client.post("/raw", content=_chunks(body), headers={"content-type": "application/json"})
+
+    assert received == [body]
+    assert response.content == body
+    assert response.headers["content-length"] == str(len(body))
+    check.assert_not_awaited()
+    start.assert_not_awaited()
+
+
+def test_request_without_leading_method_falls_back_to_full_parse(limiter, client):
+    """A method key after params is found by the full parse and passed through"""
+    check, _ = limiter
+    body = b'{"params":{"method":"tasks.execute","padding":"' + b"z" * 300 + b'"},"method":"tasks.list","id":2}'
+
+    response = client.post("/raw", content=_chunks(body), headers={"content-type": "application/json"})
+
+    assert received == [body]
+    assert response.content == body
+    check.assert_not_awaited()
+
+
+def test_task_request_gets_quota_info_and_correct_content_length(limiter, client):
+    """The JSON response gains quota_info and its content-length matches the new body"""
+    check, start = limiter
+    body = _task_request()
+
+    response = client.post("/json", content=_chunks(body), headers={"content-type": "application/json"})
+
+    assert received == [body]
+    expected = orjson.dumps({
+        "jsonrpc": "2.0",
+        "id": 7,
+        "result": {
+            "root_task_id": "t1",
+            "quota_info": {"total_used": 3, "total_limit": 10, "llm_used": 0, "llm_limit": 1},
+        },
+    })
+    assert response.content == expected
+    assert response.headers["content-length"] == str(len(expected))
+    check.assert_awaited_once_with(user_id="u1", is_llm_consuming=False, has_llm_key=False)
+    start.assert_awaited_once_with(user_id="u1", task_tree_id="t1", is_llm_consuming=False)
+
+
+def test_non_json_response_passes_through(limiter, client):
+    """A non-JSON response to a task request is neither buffered nor rewritten"""
+    _, start = limiter
+    body = _task_request()
+
+    response = client.post("/text", content=body, headers={"content-type": "application/json"})
+
+    assert received == [body]
+    assert response.content == b"not json"
+    assert response.headers["content-length"] == "8"
+    start.assert_not_awaited()
+
+
+def test_streaming_response_passes_through(limiter, client):
+    """Event streams are forwarded chunk by chunk without quota info"""
+    _, start = limiter
+    body = _task_request("tasks.generate")
+
+    response = client.post("/stream", content=body, headers={"content-type": "application/json"})
+
+    assert received == [body]
+    assert response.content == b"data: 0\n\ndata: 1\n\ndata: 2\n\n"
+    assert "content-length" not in response.headers
+    start.assert_not_awaited()
@@ -0,0 +1,148 @@
+"""
+Tests for QuotaRepository counter operations
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.orm import Session
+
+from apflow_demo.storage.models import (
+    QuotaCounter,
+    ConcurrencyCounter,
+    TaskTreeTracking,
+    UsageStats,
+)
+from apflow_demo.storage.quota_repository import QuotaRepository
+
+
+@pytest.fixture
+def repo():
+    """QuotaRepository over an in-memory SQLite database"""
+    engine = create_engine("sqlite://")
+    tables = [m.__table__ for m in (QuotaCounter, ConcurrencyCounter, TaskTreeTracking, UsageStats)]
+    QuotaCounter.metadata.create_all(engine, tables=tables)
+    with Session(engine) as session:
+        yield QuotaRepository(session)
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_increment_quota_count_accumulates(repo):
+    """Repeated increments upsert into a single counter row"""
+    assert await repo.increment_quota_count("u1", "2026-01-01", "total", 2) == 2
+    assert await repo.increment_quota_count("u1", "2026-01-01", "total", 3) == 5
+    assert await repo.get_quota_count("u1", "2026-01-01", "total") == 5
+    assert await repo.get_quota_count("u1", "2026-01-01", "llm") == 0
+
+
+@pytest.mark.asyncio
+async def test_decrement_concurrency_clamps_at_zero(repo):
+    """Decrement never goes negative and ignores missing rows"""
+    assert await repo.increment_concurrency("user", "u1") == 1
+    assert await repo.decrement_concurrency("user", "u1", 5) == 0
+    assert await repo.decrement_concurrency("user", "missing") == 0
+
+
+@pytest.mark.asyncio
+async def test_increment_usage_stat_accumulates(repo):
+    """Usage stats upsert per (date, stat_type, identifier)"""
+    await repo.increment_usage_stat("2026-01-01", "total", "global")
+    await repo.increment_usage_stat("2026-01-01", "total", "global")
+    assert await repo.get_usage_stat("2026-01-01", "total", "global") == 2
+
+
+@pytest.mark.asyncio
+async def test_apply_counter_deltas_adds_to_existing_rows(repo):
+    """Batched deltas insert new rows and add onto existing ones"""
+    await repo.increment_quota_count("u1", "2026-01-01", "total", 1)
+    await repo.apply_counter_deltas({
+        QuotaCounter: {("u1", "2026-01-01", "total"): 4, ("u1", "2026-01-01", "llm"): 1},
+        ConcurrencyCounter: {("system", "global"): 2},
+    })
+    assert await repo.get_quota_count("u1", "2026-01-01", "total") == 5
+    assert await repo.get_quota_count("u1", "2026-01-01", "llm") == 1
+    assert await repo.get_concurrency_count("system", "global") == 2
+
+
+@pytest.mark.asyncio
+async def test_get_user_active_task_trees_issues_single_query(repo):
+    """Listing active task trees and reading their fields costs one SELECT"""
+    await repo.start_task_tree("t1", "u1", True)
+    await repo.start_task_tree("t2", "u1", False)
+    repo.session.expunge_all()
+
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = repo.session.get_bind()
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        trees = await repo.get_user_active_task_trees("u1")
+        flags = sorted(tree.is_llm_consuming for tree in trees)
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+    assert flags == [False, True]
+    assert len(statements) <= 2
+
+
+@pytest.mark.asyncio
+async def test_bulk_start_task_trees_inserts_all_rows(repo):
+    """Bulk start tracks every task tree as active"""
+    rows = [(f"t{i}", "u1", i % 2 == 0) for i in range(10)]
+    assert await repo.bulk_start_task_trees(rows) == 10
+    assert len(await repo.get_user_active_task_trees("u1")) == 10
+
+
+@pytest.mark.asyncio
+async def test_record_task_tree_start_updates_counters_together(repo):
+    """Tracking row and all counters are written in one transaction"""
+    counts = await repo.record_task_tree_start("t1", "u1", "2026-01-01", True)
+    assert counts == {"total": 1, "llm": 1, "system": 1, "user": 1}
+    assert await repo.get_active_task_tree("t1") is not None
+
+    with pytest.raises(Exception):
+        await repo.record_task_tree_start("t1", "u1", "2026-01-01", False)
+    await repo.session.rollback()
+    assert await repo.get_quota_count("u1", "2026-01-01", "total") == 1
+    assert await repo.get_concurrency_count("user", "u1") == 1
+
+
+@pytest.mark.asyncio
+async def test_record_task_tree_completion_releases_slots_once(repo):
+    """Completing a tree frees both concurrency slots, and only the first time"""
+    await repo.record_task_tree_start("t1", "u1", "2026-01-01", False)
+    await repo.record_task_tree_start("t2", "u1", "2026-01-01", False)
+
+    assert await repo.record_task_tree_completion("t1", "u1") == {"system": 1, "user": 1}
+    assert await repo.get_active_task_tree("t1") is None
+    assert await repo.record_task_tree_completion("t1", "u1") is None
+    assert await repo.record_task_tree_completion("missing", "u1") is None
+    assert await repo.get_concurrency_count("user", "u1") == 1
+
+
+@pytest.mark.asyncio
+async def test_release_stale_task_trees_frees_concurrency_once(repo):
+    """Stale active trees are completed and their slots released exactly once"""
+    await repo.record_task_tree_start("t1", "u1", "2026-01-01", False)
+    await repo.record_task_tree_start("t2", "u2", "2026-01-01", False)
+    await repo.session.execute(
+        update(TaskTreeTracking)
+        .where(TaskTreeTracking.task_tree_id == "t1")
+        .values(started_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+    )
+    await repo.session.commit()
+
+    counts = await repo.release_stale_task_trees(datetime(2021, 1, 1, tzinfo=timezone.utc))
+    assert counts == {("system", "global"): 1, ("user", "u1"): 0}
+    assert await repo.get_active_task_tree("t1") is None
+    assert await repo.get_active_task_tree("t2") is not None
+
+    # A late completion for the released tree must not release it again
+    assert await repo.complete_task_tree("t1") is None
+    assert await repo.release_stale_task_trees(datetime(2021, 1, 1, tzinfo=timezone.utc)) == {}
+    assert await repo.get_concurrency_count("system", "global") == 1
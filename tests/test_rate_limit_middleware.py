@@ -0,0 +1,75 @@
+"""
+Tests for RateLimitMiddleware
+"""
+
+from unittest import mock
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from apflow_demo.api.middleware.rate_limit import RateLimitMiddleware
+from apflow_demo.config.settings import settings
+from apflow_demo.extensions.rate_limiter import RateLimiter
+
+
+async def hello(request: Request) -> Response:
+    """Plain response"""
+    return PlainTextResponse("hello")
+
+
+app = Starlette(routes=[Route("/api/hello", hello), Route("/health", hello)])
+app.add_middleware(RateLimitMiddleware)
+
+
+@pytest.fixture
+def limiter():
+    """Rate limiting enabled, with the limiter checks replaced"""
+    with mock.patch.object(settings, "rate_limit_enabled", True), \
+            mock.patch.object(RateLimiter, "check_limit", new_callable=mock.AsyncMock) as check, \
+            mock.patch.object(RateLimiter, "record_request", new_callable=mock.AsyncMock) as record:
+        check.return_value = (True, {"allowed": True})
+        yield check, record
+
+
+@pytest.fixture
+def client():
+    """TestClient over the middleware-wrapped app"""
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_allowed_request_is_recorded(limiter, client):
+    """An allowed request reaches the route and is counted by forwarded IP"""
+    check, record = limiter
+    response = client.get("/api/hello", headers={"x-forwarded-for": "203.0.113.9, 10.0.0.1"})
+
+    assert response.status_code == 200
+    assert response.content == b"hello"
+    check.assert_awaited_once_with(user_id=None, ip_address="203.0.113.9")
+    record.assert_awaited_once_with(user_id=None, ip_address="203.0.113.9")
+
+
+def test_denied_request_gets_429(limiter, client):
+    """A request over the limit never reaches the route"""
+    check, record = limiter
+    check.return_value = (False, {"reason": "ip_limit_exceeded", "ip_count": 50, "ip_limit": 50})
+
+    response = client.get("/api/hello")
+
+    assert response.status_code == 429
+    assert response.json()["error"]["data"]["reason"] == "ip_limit_exceeded"
+    record.assert_not_awaited()
+
+
+def test_skipped_path_bypasses_limiter(limiter, client):
+    """Health checks pass straight through without touching the limiter"""
+    check, record = limiter
+    response = client.get("/health")
+
+    assert response.content == b"hello"
+    check.assert_not_awaited()
+    record.assert_not_awaited()
@@ -0,0 +1,54 @@
+"""
+Tests for the demo lifespan attached by create_demo_app
+"""
+
+from unittest import mock
+
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+from apflow.core.storage import create_pooled_session
+from apflow_demo.api import server
+from apflow_demo.storage.models import DemoUser, QuotaCounter, TaskTreeTracking
+
+DEMO_TABLES = [model.__table__.name for model in (DemoUser, QuotaCounter, TaskTreeTracking)]
+
+
+@pytest.mark.parametrize("app_class", [FastAPI, Starlette])
+def test_lifespan_runs_schema_setup_and_counter_flush(app_class):
+    """FastAPI and Starlette apps both run schema setup and flush counters on shutdown"""
+    app = app_class()
+    server._attach_lifespan(app)
+
+    with mock.patch.object(server, "init_demo_schema", new_callable=mock.AsyncMock) as init_schema, \
+            mock.patch.object(server, "migrate_demo_schema", new_callable=mock.AsyncMock) as migrate, \
+            mock.patch.object(server.counter_flusher, "close", new_callable=mock.AsyncMock) as close:
+        with TestClient(app):
+            init_schema.assert_awaited_once()
+            migrate.assert_awaited_once()
+            close.assert_not_awaited()
+        close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_fastapi_lifespan_creates_demo_tables():
+    """Starting a FastAPI app leaves the demo tables in the database"""
+    app = FastAPI()
+    server._attach_lifespan(app)
+
+    with TestClient(app):
+        pass
+
+    async with create_pooled_session() as session:
+        engine = session.bind
+        if isinstance(session, AsyncSession):
+            async with engine.connect() as conn:
+                table_names = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names())
+        else:
+            table_names = inspect(engine).get_table_names()
+
+    assert set(DEMO_TABLES) <= set(table_names)
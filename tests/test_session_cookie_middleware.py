@@ -0,0 +1,86 @@
+"""
+Tests for the pure-ASGI SessionCookieMiddleware
+"""
+
+from unittest import mock
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from apflow_demo.api.middleware import session_cookie
+from apflow_demo.api.middleware.session_cookie import SessionCookieMiddleware
+
+
+async def hello(request: Request) -> Response:
+    """Plain response that sets a cookie of its own"""
+    response = PlainTextResponse("hello")
+    response.set_cookie("theme", "dark")
+    return response
+
+
+app = Starlette(routes=[
+    Route("/api/hello", hello, methods=["GET", "OPTIONS"]),
+    Route("/static/app.js", hello),
+])
+app.add_middleware(SessionCookieMiddleware)
+
+
+@pytest.fixture
+def tracking():
+    """Token helpers and background activity tracking replaced by mocks"""
+    with mock.patch.object(session_cookie, "generate_user_id_from_fingerprint", return_value="fp-user"), \
+            mock.patch.object(session_cookie, "get_demo_jwt_token", return_value="new-token"), \
+            mock.patch.object(session_cookie, "get_user_id_from_token", return_value="cookie-user"), \
+            mock.patch.object(session_cookie, "_schedule_user_tracking") as schedule:
+        yield schedule
+
+
+@pytest.fixture
+def client():
+    """TestClient over the middleware-wrapped app"""
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_first_visit_sets_authorization_cookie(tracking, client):
+    """A request without a token gets one, next to the route's own cookies"""
+    response = client.get("/api/hello", headers={"user-agent": "pytest"})
+
+    assert response.content == b"hello"
+    assert response.headers["content-length"] == "5"
+    set_cookies = response.headers.get_list("set-cookie")
+    assert len(set_cookies) == 2
+    assert set_cookies[0].startswith("theme=dark")
+    authorization = set_cookies[1]
+    assert authorization.startswith("authorization=new-token;")
+    assert "HttpOnly" in authorization
+    assert "Max-Age=31536000" in authorization
+    assert "SameSite=lax" in authorization
+    tracking.assert_called_once_with("fp-user", "pytest")
+
+
+def test_existing_token_is_left_alone(tracking, client):
+    """A request that already carries the cookie gets no new Set-Cookie"""
+    client.cookies.set("authorization", "old-token")
+    response = client.get("/api/hello")
+    client.cookies.clear()
+
+    assert response.content == b"hello"
+    set_cookies = response.headers.get_list("set-cookie")
+    assert len(set_cookies) == 1
+    assert set_cookies[0].startswith("theme=dark")
+    tracking.assert_called_once_with("cookie-user", "testclient")
+
+
+@pytest.mark.parametrize("method, path", [("OPTIONS", "/api/hello"), ("GET", "/static/app.js")])
+def test_preflight_and_static_paths_bypass(tracking, client, method, path):
+    """Preflights and static assets get no session and no tracking"""
+    response = client.request(method, path)
+
+    assert response.content == b"hello"
+    assert not any(c.startswith("authorization=") for c in response.headers.get_list("set-cookie"))
+    tracking.assert_not_called()